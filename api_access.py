@@ -1,6 +1,8 @@
 import os
 
 from hxxp import Requester
+from hxxp import esi_scheduler
+from hxxp import SingleFlight
 from authentication import EmptyToken
 import authentication as auth
 
@@ -86,7 +88,18 @@ tok = auth.EveOnlineFlow(
     disk_path="token.pkl",
 )
 
-requester = Requester("https://esi.evetech.net/latest/", EmptyToken())
-authed_requester = Requester("https://esi.evetech.net/latest/", tok)
+requester = Requester(
+    "https://esi.evetech.net/latest/",
+    EmptyToken(),
+    scheduler=esi_scheduler,
+    single_flight=SingleFlight(),
+)
+authed_requester = Requester(
+    "https://esi.evetech.net/latest/",
+    tok,
+    session=requester.session,
+    scheduler=esi_scheduler,
+    single_flight=SingleFlight(),
+)
 
 
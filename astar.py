@@ -1,25 +1,19 @@
-from queue import PriorityQueue
+import heapq
+import itertools
 import time
 
 
-class QueueItem:
-
-    def __init__(self, priority, item):
-        self.priority = priority
-        self.item = item
-
-    def __lt__(self, b):
-        return self.priority < b.priority
-
-
 DONE = object()
 
 
 def _path_from_predecessors(preds, end):
-    if end is DONE:
-        return []
-    else:
-        return _path_from_predecessors(preds, preds.get(end, DONE)) + [end]
+    path = []
+    node = end
+    while node is not DONE:
+        path.append(node)
+        node = preds.get(node, DONE)
+    path.reverse()
+    return path
 
 
 def state_astar(
@@ -29,37 +23,58 @@ def state_astar(
     heuristic: callable,
     trace: callable = None,
 ):
-    fringe = PriorityQueue()
+    """
+    A* search from `initial` to `final`.
+
+    `neighbors_of(state)` yields `(transition, neighbor, cost)` and
+    `heuristic(state, final)` estimates the remaining cost.  Returns the total
+    cost and the transitions along the cheapest path.
+
+    The fringe is a binary heap.  Rather than updating a state's priority in
+    place when a cheaper path to it turns up, the state is pushed again and
+    the outdated entry is skipped when it surfaces, its cost being worse than
+    the best known one.  Ties on priority go to the state with the larger
+    cost so far (the one closer to the goal), then to the oldest entry.
+    """
     best_known_cost_to = {}
     best_known_predecessor_to = {}
     transition_list = {}
+    tiebreak = itertools.count()
 
     best_known_cost_to[initial] = 0
-    fringe.put(QueueItem(heuristic(initial, final), initial))
+    fringe = [(heuristic(initial, final), 0, next(tiebreak), initial)]
 
-    fringe_size = fringe.qsize()
+    expanded = 0
     trace_timer = time.time()
     trace_interval_seconds = 10
 
-    while fringe_size:
-        entry = fringe.get(block=False)
-        current = entry.item
+    while fringe:
+        (priority, neg_cost, _, current) = heapq.heappop(fringe)
+        cost_to_current = best_known_cost_to[current]
+
+        # Superseded by a cheaper path found after this entry was pushed
+        if -neg_cost > cost_to_current:
+            continue
+
+        expanded += 1
 
         if (
             trace and time.time() - trace_timer > trace_interval_seconds
         ):
             trace(
                 f"Search progress: "
-                f"heuristic={entry.priority} "
-                f"cost={best_known_cost_to[current]} "
+                f"heuristic={priority} "
+                f"cost={cost_to_current} "
                 f"[{current}] "
-                f"({fringe_size=})"
+                f"(fringe_size={len(fringe)} {expanded=})"
             )
             trace_timer = time.time()
 
         if current == final:
+            if trace:
+                trace(f"Search complete ({expanded=})")
             return (
-                best_known_cost_to[current],
+                cost_to_current,
                 [
                     transition_list.get(x) for x in
                     _path_from_predecessors(best_known_predecessor_to, current)[1:]
@@ -67,7 +82,7 @@ def state_astar(
             )
 
         for (transition, n, cost) in neighbors_of(current):
-            found_cost = best_known_cost_to[current] + cost
+            found_cost = cost_to_current + cost
             if (
                 n not in best_known_cost_to or
                 found_cost < best_known_cost_to[n]
@@ -75,10 +90,15 @@ def state_astar(
                 best_known_cost_to[n] = found_cost
                 best_known_predecessor_to[n] = current
                 transition_list[n] = transition
-                if n not in [x.item for x in fringe.queue]:
-                    fringe.put(QueueItem(found_cost + heuristic(n, final), n))
-
-        fringe_size = fringe.qsize()
+                heapq.heappush(
+                    fringe,
+                    (
+                        found_cost + heuristic(n, final),
+                        -found_cost,
+                        next(tiebreak),
+                        n,
+                    ),
+                )
 
     # If we exhausted all our options, there is no route
     raise RuntimeError("No route")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+
+import aiohttp
+import requests
+from requests import HTTPError
+from requests.structures import CaseInsensitiveDict
+
+from authentication import AccessToken
+from authentication import EmptyToken
+from hxxp import RequestScheduler
+from hxxp import esi_scheduler
+
+
+#
+# Making requests
+#
+
+
+class AsyncRequester:
+    """
+    `AsyncRequester` is the asyncio counterpart of `hxxp.Requester`.
+
+    It offers the same conveniences (base URL joining, `AccessToken`
+    authentication, common extra headers, a single `request` method taking the
+    HTTP method name as a string) but performs the requests on an `aiohttp`
+    session, so a single thread can keep hundreds of requests in flight.
+
+    The number of requests in flight at any time is bounded by a semaphore of
+    size `concurrency`.  The semaphore is shared by every coroutine using this
+    requester, so callers can fan out with `asyncio.gather` freely and the
+    bound still holds globally.
+
+    Requests also go through `scheduler`, the same `hxxp.RequestScheduler`
+    the synchronous requesters use (`esi_scheduler` unless told otherwise),
+    so async and threaded code share one rate limit, one ESI error budget and
+    one pause, and failed requests are retried the same way.  Pass
+    `scheduler=None` to bypass it.
+
+    Responses are read completely before `request` returns and are handed
+    back as `AsyncResponse` objects, which mimic the parts of
+    `requests.Response` used by the `hxxp.ResponseHandler` classes.  That way
+    `DefaultHandlers.raise_or_return_json` and friends work unmodified.
+    """
+
+    def __init__(
+        self,
+        url,
+        token: AccessToken = EmptyToken(),
+        common_extra_headers=None,
+        concurrency=100,
+        limit_per_host=0,
+        scheduler: RequestScheduler = esi_scheduler,
+    ):
+        """Initialize the instance."""
+        self.url = url
+        self.token = token
+        self.common_extra_headers = common_extra_headers or {}
+        self.concurrency = concurrency
+        self.limit_per_host = limit_per_host
+        self.scheduler = scheduler
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self):
+        # The session has to be created from inside a running event loop, so
+        # it is created lazily on first use.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency,
+                limit_per_host=self.limit_per_host,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _construct_url(self, path):
+        return self.url.rstrip("/") + "/" + path.lstrip("/")
+
+    async def request(self, method, path="/", extra_headers=None, **kwargs):
+        """
+        Perform an HTTP request.
+
+        Arguments are the same as for `hxxp.Requester.request`; additional
+        keyword arguments (`params`, `json`, `data`, ...) are forwarded to
+        `aiohttp.ClientSession.request`.
+        """
+        extra_headers = extra_headers or {}
+        # See `hxxp.Requester.request`: auth headers have to be recomputed for
+        # every request to account for token expiry.
+        normal_headers = {**self.token.auth_headers}
+        headers = {
+            **normal_headers,
+            **self.common_extra_headers,
+            **extra_headers,
+        }
+        url = self._construct_url(path)
+
+        async def _send():
+            async with self.semaphore:
+                return await self._send(method, url, headers, **kwargs)
+
+        if self.scheduler is not None:
+            return await self.scheduler.arun(_send)
+        else:
+            return await _send()
+
+    async def _send(self, method, url, headers, **kwargs):
+        # Raise the `requests` exceptions, which is what the scheduler retries
+        # (and what callers of the synchronous requester already catch)
+        try:
+            async with self.session.request(
+                method.upper(),
+                url,
+                headers=headers,
+                **kwargs,
+            ) as res:
+                content = await res.read()
+        except aiohttp.ClientConnectionError as e:
+            raise requests.exceptions.ConnectionError(e) from e
+        except asyncio.TimeoutError as e:
+            raise requests.exceptions.Timeout(e) from e
+        return AsyncResponse(
+            url=str(res.url),
+            status_code=res.status,
+            reason=res.reason,
+            headers=CaseInsensitiveDict(res.headers),
+            content=content,
+        )
+
+
+#
+# Responses
+#
+
+
+class AsyncResponse:
+    """
+    Fully-read response from an `AsyncRequester`.
+
+    Quacks enough like a `requests.Response` for the `hxxp` response handlers
+    and the existing client code (`ok`, `status_code`, `headers`, `json()`,
+    `text`, `raise_for_status()`).
+    """
+
+    def __init__(self, url, status_code, reason, headers, content):
+        """Initialize the instance."""
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError(
+                f"{self.status_code} Error: {self.reason} for url: {self.url}",
+                response=self,
+            )
+
+    def __repr__(self):
+        return f"<AsyncResponse [{self.status_code}]>"
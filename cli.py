@@ -8,18 +8,20 @@ from cytoolz import groupby
 
 from authentication import EmptyToken
 from hxxp import Requester
+from hxxp import esi_scheduler
+from purchase_tour import load_system_graph
 from purchase_tour import optimize_purchase
 from purchase_tour import Purchase
 from purchase_tour import Travel
-# FIXME: should maybe move this
-from purchase_tour import load_system_graph
 from purchase_tour import markets_inventories
 from purchase_tour import orders_in_regions
 from purchase_tour import item_to_location_candidates
+from purchase_tour import travel_routes
 from universe import ItemFactory
 from universe import UniverseLookup
 from universe import station_lookup
 from industry import BlueprintLookup
+from jump_distances import JumpDistances
 
 
 TIME_COSTS = {
@@ -75,7 +77,11 @@ def cli():
 @click.argument("kind")
 @click.argument("name")
 def universe(name, brief, kind):
-    requester = Requester("https://esi.evetech.net/latest/", EmptyToken())
+    requester = Requester(
+        "https://esi.evetech.net/latest/",
+        EmptyToken(),
+        scheduler=esi_scheduler,
+    )
     universe = UniverseLookup(requester)
     if brief:
         print(universe.from_name(name))
@@ -87,7 +93,11 @@ def universe(name, brief, kind):
 @click.option("-b", "--brief", is_flag=True)
 @click.argument("terms")
 def item(terms, brief):
-    requester = Requester("https://esi.evetech.net/latest/", EmptyToken())
+    requester = Requester(
+        "https://esi.evetech.net/latest/",
+        EmptyToken(),
+        scheduler=esi_scheduler,
+    )
     universe = UniverseLookup(requester)
     items = ItemFactory(requester, "types.json")
     item = items.from_terms(terms)
@@ -125,6 +135,10 @@ def item(terms, brief):
     type=click.Choice(TIME_COSTS.keys()),
     default="normal",
 )
+@click.option(
+    "--show-route",
+    is_flag=True,
+)
 @click.argument("items", type=click.File("r"))
 def plot(
     start_station,
@@ -132,6 +146,7 @@ def plot(
     region,
     opportunity_cost_per_second,
     sweat_level,
+    show_route,
     items,
 ):
     # Better name for the variable
@@ -144,7 +159,11 @@ def plot(
 
     desired = parse_recipe_lines(items)
 
-    requester = Requester("https://esi.evetech.net/latest/", EmptyToken())
+    requester = Requester(
+        "https://esi.evetech.net/latest/",
+        EmptyToken(),
+        scheduler=esi_scheduler,
+    )
     universe = UniverseLookup(requester)
 
     if start_station is None and end_station is None:
@@ -166,8 +185,10 @@ def plot(
 
     items = ItemFactory(requester, "types.json")
 
-    # FIXME: This graph has particular regions baked in!
+    # Covers whatever graph_crawler was asked to crawl; crawl without
+    # naming regions to plan across all of New Eden
     system_graph = load_system_graph("graph.pkl")
+    distances = JumpDistances.load_or_build("graph.pkl", system_graph)
 
     (total_cost, procedure) = optimize_purchase(
         requester=requester,
@@ -178,6 +199,7 @@ def plot(
         start_position=start_position,
         end_position=end_position,
         cost_per_second=cost_per_second,
+        distances=distances,
     )
 
     costs = {
@@ -193,9 +215,22 @@ def plot(
 
     print("")
 
-    for entry in procedure:
-        if isinstance(entry, Purchase):
-            print(entry.format(universe))
+    if not show_route:
+        for entry in procedure:
+            if isinstance(entry, Purchase):
+                print(entry.format(universe))
+        return
+
+    steps = list(travel_routes(system_graph, start_position, procedure))
+    system_names = universe.ids_to_names(
+        {s for (_, systems) in steps for s in systems or []}
+    )
+    for (entry, systems) in steps:
+        print(entry.format(universe))
+        if systems and len(systems) > 1:
+            print("    " + " > ".join(
+                system_names.get(s) or str(s) for s in systems
+            ))
 
 
 @cli.command()
@@ -226,7 +261,11 @@ def orders(region, order_type, locations, reverse, items):
 
     desired = parse_recipe_lines(items)
 
-    requester = Requester("https://esi.evetech.net/latest/", EmptyToken())
+    requester = Requester(
+        "https://esi.evetech.net/latest/",
+        EmptyToken(),
+        scheduler=esi_scheduler,
+    )
     universe = UniverseLookup(requester)
 
     region_ids = [
@@ -241,7 +280,19 @@ def orders(region, order_type, locations, reverse, items):
     }
     required_ids = {item_id for (_, item_id) in required}
 
-    market_entries = orders_in_regions(requester, region_ids, required_ids)
+    market_entries = list(
+        orders_in_regions(requester, region_ids, required_ids)
+    )
+
+    # Name everything in the listing up front, in bulk, so the rows below
+    # only hit the cache
+    universe.ids_to_names(
+        {
+            entry[k]
+            for entry in market_entries
+            for k in ["type_id", "system_id", "location_id"]
+        }
+    )
 
     if locations:
         entries_ids = item_to_location_candidates(
@@ -287,7 +338,11 @@ def orders(region, order_type, locations, reverse, items):
 def blueprint(oneline, item):
     desired = next(iter(parse_recipe_lines([f"1 {item}"])))
 
-    requester = Requester("https://esi.evetech.net/latest/", EmptyToken())
+    requester = Requester(
+        "https://esi.evetech.net/latest/",
+        EmptyToken(),
+        scheduler=esi_scheduler,
+    )
     items = ItemFactory(requester, "types.json")
     blueprints = BlueprintLookup(items)
 
@@ -3,7 +3,6 @@ import json
 from math import sqrt
 from pprint import pprint
 import sys
-import time
 
 import diskcache
 from requests import HTTPError
@@ -29,11 +28,8 @@ get_entity = EntityFactory(items, universe)
 SKILL_TIME_CONSTANT_ATTR = 275
 
 
-def populate_dogma_cache(
-    requester,
-    sleep_interval=100,
-    sleep_seconds=10,
-):
+def populate_dogma_cache(requester):
+    # Throttling and retries are handled by the requester's scheduler
     cache = diskcache.Cache("eve_dogma_attributes")
 
     all_attrs = requester.request("GET", "/dogma/attributes")
@@ -60,10 +56,6 @@ def populate_dogma_cache(
                 print(f"ERROR ({i}/{expected}) {attr} (??) {res.status_code} {res.reason}")
                 errored += 1
 
-        if (found + 1) % sleep_interval == 0:
-            print(f"SLEEP {sleep_seconds} ...")
-            time.sleep(sleep_seconds)
-
     print(f"DONE {expected=} {known=} {found=} {errored=}")
 
 
@@ -276,8 +268,6 @@ def _trace(msg):
 def json_dump_skills_from_fits_xml(
     xml_contents,
     cache_name="doctrine_fits",
-    sleep_interval=10,
-    sleep_seconds=10,
     suppress_known=True,
 ):
     cache = diskcache.Cache(cache_name)
@@ -286,8 +276,6 @@ def json_dump_skills_from_fits_xml(
 
     num_fits = len(fits)
 
-    fetches_attempted = 0
-
     for (n, fit) in enumerate(fits, start=1):
         if ("name", fit["name"]) in cache:
             skills = cache.get(("name", fit["name"]))
@@ -302,16 +290,10 @@ def json_dump_skills_from_fits_xml(
             _trace(f"FETCHED ({n}/{num_fits}) {fit['name']}")
             print(json.dumps({"fit": fit["name"], "skills": skills}), flush=True)
 
+        # The requester's scheduler already retried and backed off, so just
+        # record the failure and move on
         except HTTPError as err:
-            _trace(f"ERROR ({n}/{num_fits}) {fit['name']} {err.status_code} {err.reason}")
-            _trace(f"SLEEP ({n}/{num_fits}) for {sleep_seconds}s HTTP error throttle")
-            time.sleep(sleep_seconds)
-
-        fetches_attempted += 1
-
-        if fetches_attempted % sleep_interval == 0:
-            _trace(f"SLEEP ({n}/{num_fits}) for {sleep_seconds}s interval reached")
-            time.sleep(sleep_seconds)
+            _trace(f"ERROR ({n}/{num_fits}) {fit['name']} {err.response.status_code} {err.response.reason}")
 
 
 def compare_fits_from_cache(authed_requester, character_name, cache_name):
@@ -392,8 +374,6 @@ def main():
     parser.add_argument("--purge", action="store_true")
     parser.add_argument("-c", "--character-name", "--character")
     parser.add_argument("-C", "--cache-name", "--cache", default="doctrine_fits")
-    parser.add_argument("-i", "--sleep-interval", "--interval", type=int, default=100)
-    parser.add_argument("-d", "--sleep-duration", "--duration", type=int, default=10)
     parser.add_argument("--always-trace", "--always", action="store_true")
     parser.add_argument("-s", "--sort", action="store_true")
     parser.add_argument("-r", "--reverse", action="store_true")
@@ -403,8 +383,6 @@ def main():
     xml_file = parsed.xml_file
     character_name = parsed.character_name
     cache_name = parsed.cache_name
-    sleep_interval = parsed.sleep_interval
-    sleep_duration = parsed.sleep_duration
     suppress_known = not parsed.always_trace
     do_sort = parsed.sort
     sort_reverse = parsed.reverse
@@ -414,8 +392,6 @@ def main():
         json_dump_skills_from_fits_xml(
             xml_contents,
             cache_name,
-            sleep_interval=sleep_interval,
-            sleep_seconds=sleep_duration,
             suppress_known=suppress_known,
         )
 
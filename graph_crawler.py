@@ -2,15 +2,24 @@ import os
 import json
 import pickle
 import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 
 import click
 
+from hxxp import DefaultHandlers
 from hxxp import Requester
+from hxxp import esi_scheduler
 from authentication import EmptyToken
 
+from system_graph import SystemGraph
 from universe import UniverseLookup
 
 
+_json = DefaultHandlers.raise_or_return_json
+
+
 class DOES_NOT_EXIST:
 
     def __repr__(self):
@@ -42,85 +51,233 @@ def slurp_pickle(path):
 
 
 def dump_pickle(data, path):
-    with open(path, "wb") as f:
-        return pickle.dump(data, f)
+    # Write aside and swap in, so a crash mid-dump leaves the old file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(data, f)
+    os.replace(tmp, path)
 
 
 #
-# Entry point
+# Crawl state
 #
 
 
-@click.command()
-@click.argument("path", type=click.Path())
-@click.argument("regions", nargs=-1)
-def cli(regions, path):
-    requester = Requester("https://esi.evetech.net/latest/", EmptyToken())
-    universe = UniverseLookup(requester)
+class CrawlState:
+    """
+    Progress of a crawl: systems done, stargates seen, edges found.
+
+    The state is a pickle (`path`) plus a write-ahead log of JSON lines
+    (`path.wal`).  Progress is appended to the log as it is made, so a crawl
+    that is interrupted picks up where it left off by replaying the log on
+    top of the pickle, without ever rewriting the whole state mid-crawl.
+    `compact` folds the log into the pickle at the end.
+
+    A system is logged as done only after all of its edges, so replaying a
+    log truncated at any point never skips a system.  A torn final record is
+    cut off before logging resumes.
+    """
+
+    def __init__(self, path):
+        """Initialize the instance."""
+        self.path = path
+        self.wal_path = f"{path}.wal"
+        self._lock = threading.Lock()
+
+        data = slurp_pickle(path)
+        if data is DNE:
+            self.systems = set([])
+            self.seen = set([])
+            self.edges = set([])
+        else:
+            self.systems = data["systems"]
+            self.seen = data["seen"]
+            self.edges = data["edges"]
+
+        self.replayed = 0
+        if os.path.exists(self.wal_path):
+            self._replay()
+
+        self._wal = open(self.wal_path, "a")
+
+    def _replay(self):
+        complete = 0
+        with open(self.wal_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn final write
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self._apply(record)
+                self.replayed += 1
+                complete += len(line)
+        # Drop whatever follows the last complete record, so new records
+        # aren't appended onto a torn line (and lost on the next replay)
+        if complete < os.path.getsize(self.wal_path):
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(complete)
+
+    def _apply(self, record):
+        if "edge" in record:
+            self.edges.add(tuple(record["edge"]))
+            self.seen.update(record["stargates"])
+        elif "system" in record:
+            self.systems.add(record["system"])
+
+    def log(self, records):
+        with self._lock:
+            for record in records:
+                self._apply(record)
+                self._wal.write(json.dumps(record) + "\n")
+            self._wal.flush()
+
+    def compact(self):
+        with self._lock:
+            dump_pickle(
+                {
+                    "seen": self.seen,
+                    "systems": self.systems,
+                    "edges": self.edges,
+                },
+                self.path,
+            )
+            # The planner reads the graph in CSR form
+            SystemGraph.from_edges(self.edges).save(self.path)
+            # Only once the pickle is safely in place; replaying the log on
+            # top of it again would be harmless
+            self._wal.close()
+            os.remove(self.wal_path)
+            self._wal = open(self.wal_path, "a")
 
-    data = slurp_pickle(path)
 
-    if data is DNE:
-        seen_systems = set([])
-        seen_stargates = set([])
-        edges = set([])
-        print(f"Initialized new graph crawler at {path}")
-    else:
-        seen_systems = data["systems"]
-        seen_stargates = data["seen"]
-        edges = data["edges"]
-        print(
-            f"Loaded {len(seen_systems)} systems and "
-            f"{len(seen_stargates)} known stargates from {path}"
-        )
+#
+# Crawling
+#
 
-    systems = itertools.chain.from_iterable(
-        universe.details("constellation", entity_id=con)["systems"]
-        for con in itertools.chain.from_iterable(
-            universe.details("region", name=region)["constellations"]
-            for region in regions
+
+def region_systems(universe, executor, regions):
+    constellations = list(
+        itertools.chain.from_iterable(
+            executor.map(
+                lambda region: universe.details(
+                    "region",
+                    name=region,
+                )["constellations"],
+                regions,
+            )
+        )
+    )
+    return list(
+        itertools.chain.from_iterable(
+            executor.map(
+                lambda con: universe.details(
+                    "constellation",
+                    entity_id=con,
+                )["systems"],
+                constellations,
+            )
         )
     )
 
-    for system_id in systems:
-        if system_id in seen_systems:
+
+def all_systems(requester):
+    return _json(requester.request("GET", "/universe/systems"))
+
+
+def crawl_system(universe, state, system_id):
+    stargates = universe.details(
+        "system",
+        entity_id=system_id,
+    ).get("stargates", [])
+
+    records = []
+    for stargate_id in stargates:
+        if stargate_id in state.seen:
             continue
 
-        stargates = universe.details(
-            "system",
-            entity_id=system_id,
-        )["stargates"]
-
-        for stargate_id in stargates:
-            if stargate_id in seen_stargates:
-                continue
-
-            print(stargate_id)
-            stargate = universe.details("stargate", entity_id=stargate_id)
-
-            edge = (stargate["system_id"], stargate["destination"]["system_id"])
-            edges.add(edge)
-            seen_stargates.add(stargate_id)
-            seen_stargates.add(stargate["destination"]["stargate_id"])
-
-        seen_systems.add(system_id)
-        dump_pickle(
-            {
-                "seen": seen_stargates,
-                "systems": seen_systems,
-                "edges": edges,
-            },
-            path,
-        )
+        stargate = universe.details("stargate", entity_id=stargate_id)
+        records.append({
+            "edge": [
+                stargate["system_id"],
+                stargate["destination"]["system_id"],
+            ],
+            "stargates": [
+                stargate_id,
+                stargate["destination"]["stargate_id"],
+            ],
+        })
+
+    records.append({"system": system_id})
+    state.log(records)
+    return system_id
+
+
+#
+# Entry point
+#
 
-    dump_pickle(
-        {
-            "seen": seen_stargates,
-            "systems": seen_systems,
-            "edges": edges,
-        },
-        path,
+
+@click.command()
+@click.option(
+    "-w",
+    "--workers",
+    default=16,
+    help="Systems crawled at once",
+)
+@click.argument("path", type=click.Path())
+@click.argument("regions", nargs=-1)
+def cli(workers, regions, path):
+    """
+    Crawl the stargate graph into PATH.
+
+    Only the named REGIONS are crawled if any are given; otherwise all of
+    New Eden.
+    """
+    requester = Requester(
+        "https://esi.evetech.net/latest/",
+        EmptyToken(),
+        scheduler=esi_scheduler,
+        pool_maxsize=workers,
     )
+    universe = UniverseLookup(requester)
+
+    state = CrawlState(path)
+    print(
+        f"Loaded {len(state.systems)} systems and "
+        f"{len(state.seen)} known stargates from {path} "
+        f"({state.replayed} log entries replayed)"
+    )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if regions:
+            systems = region_systems(universe, executor, regions)
+        else:
+            systems = all_systems(requester)
+
+        pending = [s for s in systems if s not in state.systems]
+        print(f"Crawling {len(pending)} of {len(systems)} systems")
+
+        futures = [
+            executor.submit(crawl_system, universe, state, system_id)
+            for system_id in pending
+        ]
+        try:
+            for (i, future) in enumerate(as_completed(futures), 1):
+                future.result()
+                if i % 100 == 0 or i == len(futures):
+                    print(
+                        f"{i}/{len(futures)} systems, "
+                        f"{len(state.edges)} edges"
+                    )
+        except BaseException:
+            # Progress so far is in the log; rerun to resume
+            executor.shutdown(cancel_futures=True)
+            raise
+
+    state.compact()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,522 @@
 #!/usr/bin/env python
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+import hashlib
+import random
+import threading
+import time
+
+import diskcache
 import requests
+from requests.structures import CaseInsensitiveDict
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.connectionpool import HTTPSConnectionPool
 
 from authentication import AccessToken
 from authentication import EmptyToken
 
 
+#
+# Connection pooling
+#
+
+
+class ConnectionStats:
+    """
+    Thread-safe tally of connections opened versus requests sent.
+
+    Every request sent over a pooled session either opens a fresh connection
+    (paying for the TCP and TLS handshakes) or reuses a kept-alive one from the
+    pool.  Comparing the two numbers tells us how much the pool is saving us.
+    """
+
+    def __init__(self):
+        """Initialize the instance."""
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.requests = 0
+
+    def record_open(self):
+        with self._lock:
+            self.opened += 1
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def reused(self):
+        return max(0, self.requests - self.opened)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "requests": self.requests,
+                "reused": max(0, self.requests - self.opened),
+            }
+
+    def __repr__(self):
+        s = self.snapshot()
+        return (
+            f"<ConnectionStats opened={s['opened']} "
+            f"reused={s['reused']} requests={s['requests']}>"
+        )
+
+
+def _counting_pool_class(base, stats):
+
+    class _CountingPool(base):
+
+        def _new_conn(self):
+            stats.record_open()
+            return super()._new_conn()
+
+    return _CountingPool
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    `HTTPAdapter` whose connection pools report new connections to a
+    `ConnectionStats` instance.
+    """
+
+    def __init__(self, stats, **kwargs):
+        """Initialize the instance."""
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self.stats),
+            "https": _counting_pool_class(HTTPSConnectionPool, self.stats),
+        }
+
+
+def pooled_session(pool_connections=10, pool_maxsize=32, stats=None):
+    """
+    Create a keep-alive `requests.Session` backed by a connection pool.
+
+    `pool_connections` is the number of distinct hosts to keep pools for, and
+    `pool_maxsize` is the number of connections kept alive per host.  The
+    pool size should be at least the number of threads which share the session,
+    otherwise surplus connections are discarded after use instead of being
+    returned to the pool.
+    """
+    stats = stats or ConnectionStats()
+    session = requests.Session()
+    adapter = PooledAdapter(
+        stats,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.stats = stats
+    return session
+
+
+#
+# Rate limiting and retries
+#
+
+
+def _int_header(response, name, default=None):
+    try:
+        return int(response.headers.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class RequestScheduler:
+    """
+    Rate limiter and retry policy shared by every thread making ESI requests.
+
+    Three mechanisms keep bulk jobs running at the maximum safe rate:
+
+    1. A token bucket admits at most `rate` requests per second on average,
+       with bursts of up to `burst` requests.
+    2. ESI reports how many errors we may still make in the current window in
+       `X-ESI-Error-Limit-Remain`, and when the window resets in
+       `X-ESI-Error-Limit-Reset`.  Once the remaining budget drops to
+       `error_floor`, every thread is held back until the window resets,
+       before the budget is exhausted and ESI starts refusing us outright.
+    3. Responses with a status in `retry_statuses` and connection errors are
+       retried up to `max_retries` times, with jittered exponential backoff
+       (or the server's `Retry-After`, when it sends one).
+
+    A single instance should be shared by all the requesters hitting the same
+    API; `esi_scheduler` is the process-wide instance for ESI.
+    """
+
+    def __init__(
+        self,
+        rate=20,
+        burst=40,
+        error_floor=20,
+        max_retries=4,
+        backoff_base=0.5,
+        backoff_cap=30,
+        retry_statuses=(420, 429, 500, 502, 503, 504),
+    ):
+        """Initialize the instance."""
+        self.rate = rate
+        self.burst = burst
+        self.error_floor = error_floor
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retry_statuses = set(retry_statuses)
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._paused_until = 0
+        self.error_remain = None
+        self.retries = 0
+        self.pauses = 0
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def _admit(self):
+        """Take a token if one is available now, else return the wait."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Block until this thread may send a request."""
+        wait = self._admit()
+        while wait is not None:
+            time.sleep(wait)
+            wait = self._admit()
+
+    async def aacquire(self):
+        """Wait, without blocking the event loop, until a request may be sent."""
+        wait = self._admit()
+        while wait is not None:
+            await asyncio.sleep(wait)
+            wait = self._admit()
+
+    def pause(self, seconds):
+        """Hold back every thread for `seconds`."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self.pauses += 1
+
+    def observe(self, response):
+        """Update the error budget from the headers of `response`."""
+        remain = _int_header(response, "X-ESI-Error-Limit-Remain")
+        reset = _int_header(response, "X-ESI-Error-Limit-Reset")
+        if remain is not None:
+            self.error_remain = remain
+        if reset is not None and (
+            response.status_code == 420
+            or (remain is not None and remain <= self.error_floor)
+        ):
+            # Wait out the window, plus a little slack for clock skew
+            self.pause(reset + 1)
+
+    def _count_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def backoff(self, attempt, response=None):
+        retry_after = (
+            _int_header(response, "Retry-After") if response is not None
+            else None
+        )
+        if retry_after is not None:
+            return retry_after
+        ceiling = min(self.backoff_cap, self.backoff_base * 2**attempt)
+        return random.uniform(0, ceiling)
+
+    def run(self, send):
+        """
+        Send a request through the scheduler.
+
+        `send` is a callable with no arguments performing the request and
+        returning the response.  It may be called several times.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                response = send()
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ):
+                if attempt == self.max_retries:
+                    raise
+                self._count_retry()
+                time.sleep(self.backoff(attempt))
+                continue
+
+            self.observe(response)
+
+            if (
+                response.status_code in self.retry_statuses
+                and attempt < self.max_retries
+            ):
+                self._count_retry()
+                time.sleep(self.backoff(attempt, response))
+                continue
+
+            return response
+
+    async def arun(self, send):
+        """
+        Async counterpart of `run`.
+
+        `send` is a coroutine function with no arguments.  Connection errors
+        are expected as `requests` exceptions, which `async_hxxp` raises in
+        place of the `aiohttp` ones.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.aacquire()
+            try:
+                response = await send()
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ):
+                if attempt == self.max_retries:
+                    raise
+                self._count_retry()
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+
+            self.observe(response)
+
+            if (
+                response.status_code in self.retry_statuses
+                and attempt < self.max_retries
+            ):
+                self._count_retry()
+                await asyncio.sleep(self.backoff(attempt, response))
+                continue
+
+            return response
+
+
+esi_scheduler = RequestScheduler()
+
+
+#
+# Request coalescing
+#
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls into a single call.
+
+    When several threads call `do` with the same `key` at the same time, only
+    the first one (the leader) actually runs `func`; the others wait for it to
+    finish and receive the very same result (or exception).  Once the leader
+    is done the key is forgotten, so later calls run `func` again -- this is
+    not a cache, it only deduplicates work that is in flight.
+
+    Counts of calls made, calls executed and calls collapsed onto another
+    in-flight call are kept for reporting.
+    """
+
+    def __init__(self):
+        """Initialize the instance."""
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = 0
+        self.executed = 0
+        self.collapsed = 0
+
+    def do(self, key, func):
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.executed += 1
+            else:
+                self.collapsed += 1
+
+        if leader:
+            try:
+                flight.result = func()
+            except BaseException as err:
+                flight.error = err
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executed": self.executed,
+                "collapsed": self.collapsed,
+            }
+
+
+#
+# Response caching
+#
+
+
+class ResponseCache:
+    """
+    Conditional-request cache for GET responses.
+
+    Responses are stored together with their `ETag` and `Expires` headers,
+    keyed by URL, query parameters and the credentials they were fetched
+    with.  A `Requester` configured with a `ResponseCache` consults it before
+    every GET:
+
+    1. If there is a stored response that hasn't expired yet, it is served
+       locally without touching the network.
+    2. If the stored response has expired but carries an ETag, the request is
+       sent with `If-None-Match`.  A `304 Not Modified` reply refreshes the
+       stored expiry and the stored body is served, so revalidating costs a
+       round trip but no payload.
+    3. Otherwise the response is fetched normally and stored if it's ok.
+
+    The `store` can be anything supporting `get` and item assignment; by
+    default it is a `diskcache.Cache`, so the cache persists across processes.
+
+    Caching is opt-in: requesters only use one when given it (`cache=`, or
+    `Requester.cached`), as do the `response_cache` arguments of
+    `OrderFetcher`, `UniverseLookup` and `UserAssets`.
+    """
+
+    # Headers of a 304 describing its (empty) body rather than the cached one
+    _body_headers = {"content-length", "content-encoding", "transfer-encoding"}
+
+    def __init__(self, store=None, default_ttl=0):
+        """Initialize the instance."""
+        self.store = store if store is not None else diskcache.Cache(
+            "esi_responses",
+        )
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def record(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+            }
+
+    def key(self, url, params=None, auth_headers=None):
+        # Authenticated responses are only served back to the same
+        # credentials, so requesters with different tokens (or none) can
+        # share a store.  Hashed, so no token is written to the store.
+        identity = (
+            hashlib.sha256(
+                repr(sorted(auth_headers.items())).encode("utf-8"),
+            ).hexdigest()
+            if auth_headers else None
+        )
+        return (url, tuple(sorted((params or {}).items())), identity)
+
+    def _expiry(self, response):
+        expires = response.headers.get("Expires")
+        if expires:
+            try:
+                return parsedate_to_datetime(expires).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return time.time() + self.default_ttl
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def is_fresh(self, entry):
+        return entry["expires"] > time.time()
+
+    def conditional_headers(self, entry):
+        if entry and entry.get("etag"):
+            return {"If-None-Match": entry["etag"]}
+        else:
+            return {}
+
+    def put(self, key, response):
+        entry = {
+            "url": response.url,
+            "status_code": response.status_code,
+            "reason": response.reason,
+            "headers": dict(response.headers),
+            "content": response.content,
+            "encoding": response.encoding,
+            "etag": response.headers.get("ETag"),
+            "expires": self._expiry(response),
+        }
+        self.store[key] = entry
+        return entry
+
+    def refresh(self, key, entry, not_modified):
+        headers = CaseInsensitiveDict(entry["headers"])
+        headers.update(
+            (k, v) for (k, v) in not_modified.headers.items()
+            if k.lower() not in self._body_headers
+        )
+        entry = {
+            **entry,
+            "headers": dict(headers),
+            "etag": not_modified.headers.get("ETag", entry["etag"]),
+            "expires": self._expiry(not_modified),
+        }
+        self.store[key] = entry
+        return entry
+
+    def to_response(self, entry):
+        response = requests.Response()
+        response.url = entry["url"]
+        response.status_code = entry["status_code"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["content"]
+        response.encoding = entry["encoding"]
+        return response
+
+
 #
 # Making requests
 #
@@ -15,13 +526,25 @@ class Requester:
     """
     `Requester` provides a thin layer around the vanilla requests library.
 
-    This provides three pieces of convenient functionality:
+    This provides four pieces of convenient functionality:
 
     1. Remembers the base URL so you don't need to keep passing it around.
     2. Authenticates using an `AccessToken`, so requests will all use
        constantly refreshing credentials.
     3. Remembers miscellaneous extra headers (example: headers which disable
        CSRF) that are used in all the requests.
+    4. Keeps connections alive in a pool, so consecutive requests to the same
+       host skip the TCP and TLS handshakes.  The pool is thread-safe, so a
+       single `Requester` can be shared by all the workers of a thread pool.
+       Several `Requester` objects can share one pool by passing the same
+       `session`.
+    5. Optionally serves and revalidates GET requests through a
+       `ResponseCache` (see `cached`).
+    6. Optionally sends every request through a `RequestScheduler`, which
+       rate limits, watches the ESI error budget and retries failures.
+    7. Optionally coalesces identical concurrent GET requests (same path and
+       params) through a `SingleFlight`, so they share one network call and
+       one response object.
 
     Instead of providing separate methods for GET/POST/etc. , it provides a
     single `request` method which accepts the HTTP method name as a string.
@@ -40,11 +563,50 @@ class Requester:
         url,
         token: AccessToken = EmptyToken(),
         common_extra_headers=None,
+        session=None,
+        pool_connections=10,
+        pool_maxsize=32,
+        cache: ResponseCache = None,
+        scheduler: RequestScheduler = None,
+        single_flight: SingleFlight = None,
     ):
         """Initialize the instance."""
         self.url = url
         self.token = token
         self.common_extra_headers = common_extra_headers or {}
+        self.session = session or pooled_session(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
+        self.cache = cache
+        self.scheduler = scheduler
+        self.single_flight = single_flight
+
+    def cached(self, cache: ResponseCache):
+        """
+        Return a copy of this requester which goes through `cache`.
+
+        The copy shares this requester's token, headers and connection pool.
+        """
+        return type(self)(
+            self.url,
+            self.token,
+            common_extra_headers=self.common_extra_headers,
+            session=self.session,
+            cache=cache,
+            scheduler=self.scheduler,
+            single_flight=self.single_flight,
+        )
+
+    @property
+    def stats(self):
+        """
+        Connections opened vs. reused by this requester's session.
+
+        None for a session not made by `pooled_session`, which has nothing
+        counting its connections.
+        """
+        return getattr(self.session, "stats", None)
 
     def _construct_url(self, path):
         return self.url.rstrip("/") + "/" + path.lstrip("/")
@@ -62,10 +624,10 @@ class Requester:
         attribute are stripped so exactly one slash will always be used to join
         the base URL to this path.
         """
-        func = getattr(requests, method.lower(), None)
+        func = getattr(self.session, method.lower(), None)
         if func is None:
             raise LookupError(
-                "No function for performing method '{method.lower()}' in requests."
+                f"No function for performing method '{method.lower()}' in requests."
             )
         extra_headers = extra_headers or {}
         # auth_headers is a property that is computed dynamically to account
@@ -73,16 +635,168 @@ class Requester:
         # headers in a class member, we need to call `auth_headers` each time
         # we make a request!
         normal_headers = {**self.token.auth_headers}
-        return func(
-            self._construct_url(path),
-            headers={
-                **normal_headers,
-                **self.common_extra_headers,
+        url = self._construct_url(path)
+
+        if self.single_flight is not None and method.upper() == "GET":
+            key = (
+                method.upper(),
+                url,
+                tuple(sorted((kwargs.get("params") or {}).items())),
+            )
+            return self.single_flight.do(
+                key,
+                lambda: self._request(
+                    method, func, url, normal_headers, extra_headers, **kwargs,
+                ),
+            )
+        else:
+            return self._request(
+                method, func, url, normal_headers, extra_headers, **kwargs,
+            )
+
+    def _request(
+        self,
+        method,
+        func,
+        url,
+        normal_headers,
+        extra_headers,
+        **kwargs,
+    ):
+        entry = None
+        if self.cache is not None and method.upper() == "GET":
+            key = self.cache.key(url, kwargs.get("params"), normal_headers)
+            entry = self.cache.get(key)
+            if entry and self.cache.is_fresh(entry):
+                self.cache.record("hits")
+                return self.cache.to_response(entry)
+            extra_headers = {
+                **self.cache.conditional_headers(entry),
                 **extra_headers,
-            },
+            }
+
+        headers = {
+            **normal_headers,
+            **self.common_extra_headers,
+            **extra_headers,
+        }
+
+        stats = self.stats
+
+        def _send():
+            if stats is not None:
+                stats.record_request()
+            return func(url, headers=headers, **kwargs)
+
+        if self.scheduler is not None:
+            response = self.scheduler.run(_send)
+        else:
+            response = _send()
+
+        if self.cache is not None and method.upper() == "GET":
+            if entry and response.status_code == 304:
+                self.cache.record("revalidated")
+                entry = self.cache.refresh(key, entry, response)
+                return self.cache.to_response(entry)
+            self.cache.record("misses")
+            if response.ok:
+                self.cache.put(key, response)
+
+        return response
+
+
+#
+# Paginated requests
+#
+
+
+def _page_count(response):
+    try:
+        return int(response.headers.get("X-Pages", 1))
+    except (TypeError, ValueError):
+        return 1
+
+
+def iter_pages(
+    requester,
+    method,
+    path="/",
+    params=None,
+    max_workers=8,
+    **kwargs,
+):
+    """
+    Perform a paginated request, yielding the responses in page order.
+
+    ESI reports the total number of pages of a paginated endpoint in the
+    `X-Pages` header.  The first page is fetched on its own to learn the page
+    count, then the remaining pages are fetched concurrently on up to
+    `max_workers` threads.  Responses are still yielded strictly in page order,
+    as soon as each one (and all the pages before it) has arrived.
+
+    Responses are yielded verbatim, whatever their status, so the caller
+    decides how to handle errors.  If the first page is not ok, it is the only
+    response yielded.
+    """
+    params = params or {}
+
+    def _page(page):
+        return requester.request(
+            method,
+            path,
+            params={**params, "page": page},
+            **kwargs,
+        )
+
+    first = _page(1)
+    yield first
+
+    pages = _page_count(first)
+    if not first.ok or pages <= 1:
+        return
+
+    exe = ThreadPoolExecutor(max_workers=min(max_workers, pages - 1))
+    try:
+        yield from exe.map(_page, range(2, pages + 1))
+    finally:
+        # Don't fetch pages nobody is going to read if we're abandoned early
+        exe.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_pages(requester, method, path="/", params=None, **kwargs):
+    """
+    Async counterpart of `iter_pages`, for an `async_hxxp.AsyncRequester`.
+
+    Fetches the first page, reads the page count from `X-Pages`, then
+    schedules all the remaining pages at once (the requester's semaphore
+    bounds how many are actually in flight).  Responses are yielded in page
+    order.
+    """
+    params = params or {}
+
+    def _page(page):
+        return requester.request(
+            method,
+            path,
+            params={**params, "page": page},
             **kwargs,
         )
 
+    first = await _page(1)
+    yield first
+
+    pages = _page_count(first)
+    if not first.ok or pages <= 1:
+        return
+
+    tasks = [asyncio.ensure_future(_page(page)) for page in range(2, pages + 1)]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
 
 #
 # Handling responses
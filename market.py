@@ -1,13 +1,20 @@
+import asyncio
 import itertools
+import time
 from cytoolz import valmap
 from cytoolz import curry
 import diskcache
+import numpy as np
 
 from weighted_series import WeightedSeries
+from weighted_series import SeriesBatch
 from requests import HTTPError
 
 from hxxp import DefaultHandlers
 from hxxp import Requester
+from hxxp import SingleFlight
+from hxxp import iter_pages
+from hxxp import aiter_pages
 from authentication import EveOnlineFlow
 
 
@@ -19,22 +26,18 @@ def get_structure_orders(requester, structure_id, page=1):
 
 
 def iter_structure_orders(requester, structure_id):
-    page = 1
-    while True:
-        res = get_structure_orders(requester, structure_id, page=page)
-        if res.ok:
-            yield from res.json()
-        elif res.status_code == 404 or res.status_code == 500:
+    pages = iter_pages(requester, "GET", f"/markets/structures/{structure_id}")
+    for res in pages:
+        if res.status_code == 404:
             return
-        else:
-            print(res.__dict__)
-            yield []
-        page += 1
+        # As in `iter_orders`: raise what the scheduler couldn't retry away
+        # rather than hand back part of the market
+        yield from _json(res)
 
 
 def orders_for_item(requester, region_ids, item_id):
     return itertools.chain.from_iterable(
-        next(
+        itertools.chain.from_iterable(
             iter_orders(
                 requester,
                 {"order_type": "all"},
@@ -58,17 +61,79 @@ def get_orders(requester, query, region_id, type_id=None, page=1):
     return requester.request("GET", f"/markets/{region_id}/orders", params=params)
 
 
+def orders_params(query, type_id=None):
+    params = {**query}
+    if type_id is not None:
+        params["type_id"] = type_id
+    return params
+
+
 def iter_orders(requester, query, region_id, type_id=None):
-    page = 1
-    while True:
-        res = get_orders(requester, query, region_id, type_id=type_id, page=page)
-        if res.ok:
-            yield res.json()
-        elif res.status_code == 404:
+    pages = iter_pages(
+        requester,
+        "GET",
+        f"/markets/{region_id}/orders",
+        params=orders_params(query, type_id),
+    )
+    for res in pages:
+        if res.status_code == 404:
             return
-        else:
-            yield []
-        page += 1
+        # Anything else still failing after the scheduler's retries is
+        # raised; an empty page would pass for a complete order book
+        yield _json(res)
+
+
+#
+# Async counterparts; these take an `async_hxxp.AsyncRequester`
+#
+
+
+async def aiter_orders(requester, query, region_id, type_id=None):
+    pages = aiter_pages(
+        requester,
+        "GET",
+        f"/markets/{region_id}/orders",
+        params=orders_params(query, type_id),
+    )
+    async for res in pages:
+        if res.status_code == 404:
+            return
+        # Anything else still failing after the scheduler's retries is
+        # raised; an empty page would pass for a complete order book
+        yield _json(res)
+
+
+async def aorders_for_item(requester, region_ids, item_id):
+    orders = []
+    for region_id in region_ids:
+        async for page in aiter_orders(
+            requester,
+            {"order_type": "all"},
+            region_id,
+            int(item_id),
+        ):
+            orders.extend(page)
+    return orders
+
+
+async def aorders_for_items(requester, region_ids, item_ids):
+    """
+    Fetch the orders of every item in every region concurrently.
+
+    Returns a dict keyed like the `OrderFetcher` cache: `(item_id, region_id)`.
+    """
+    keys = [
+        (int(item_id), region_id)
+        for item_id in item_ids
+        for region_id in region_ids
+    ]
+    results = await asyncio.gather(
+        *(
+            aorders_for_item(requester, [region_id], item_id)
+            for (item_id, region_id) in keys
+        )
+    )
+    return dict(zip(keys, results))
 
 
 class OrderFetcher:
@@ -80,15 +145,28 @@ class OrderFetcher:
         authed_requester=None,
         expire=300,
         disk_cache=None,
+        response_cache=None,
+        bulk=False,
     ):
+        if response_cache is not None:
+            requester = requester.cached(response_cache)
+            if isinstance(authed_requester, Requester):
+                authed_requester = authed_requester.cached(response_cache)
         self.universe = universe
         self.requester = requester
         self._authed_requester = authed_requester
         self.default_expire = expire
+        self.bulk = bulk
         if disk_cache:
             self._orders = diskcache.Cache(disk_cache)
         else:
             self._orders = diskcache.Cache()
+        # Worker threads often ask for the same (item, region) at the same
+        # time; only one of them should download it.
+        self.inflight = SingleFlight()
+        # Region snapshots already read from disk: region id -> (expiry
+        # time, OrderBook)
+        self._books = {}
 
     @property
     def authed_requester(self):
@@ -127,38 +205,305 @@ class OrderFetcher:
 
         return self._orders.get(key, [])
 
-    def get_for_station(self, entity, station, expire=None):
+    def _download(self, key, expire):
+        (entity_id, region_id) = key
+        orders = list(orders_for_item(self.requester, [region_id], entity_id))
+        self._orders.set(key, orders, expire=expire)
+        return orders
+
+    def _download_region(self, key, expire):
+        (_, region_id) = key
+        pages = iter_orders(self.requester, {"order_type": "all"}, region_id)
+        # Columns page by page, so at most one page of dicts is alive at once
+        book = OrderBook.concat(OrderBook.from_orders(page) for page in pages)
+        # Sorted by type before storing, so readers only ever binary search
+        self._orders.set(key, book.indexed("type_id"), expire=expire)
+        return book
+
+    def snapshot_region(self, region_id, expire=None):
+        """
+        The whole order book of a region, as a single `OrderBook`.
+
+        The orders of every type are fetched in one paginated walk (whose
+        pages are fetched concurrently) and cached as one entry until it
+        expires; lookups of an item or a station in the region filter the
+        book through its sorted indexes.  Books read from the disk cache are
+        also held in memory until they expire, so repeated lookups don't
+        unpickle the region every time.
+        """
         expire = expire or self.default_expire
-        region = self.universe.chain(
-            station, "station", "system", "constellation", "region",
+        held = self._books.get(region_id)
+        if held is not None and held[0] > time.time():
+            return held[1]
+
+        key = ("region_book", region_id)
+        (book, expires_at) = self._orders.get(key, expire_time=True)
+        if book is None:
+            book = self.inflight.do(
+                key,
+                lambda: self._download_region(key, expire),
+            )
+            expires_at = time.time() + expire
+        self._books[region_id] = (expires_at, book)
+        return book
+
+    def _orders_for_key(self, key, expire):
+        orders = self._orders.get(key)
+        if orders is not None:
+            return orders
+
+        return self.inflight.do(
+            key,
+            lambda: self._download(key, expire),
         )
-        key = (entity.id, region.id)
 
-        if key not in self._orders:
-            seq = orders_for_item(self.requester, [region.id], entity.id)
-            self._orders.set(key, list(seq), expire=expire)
+    def _book_for_key(self, key, expire):
+        if self.bulk:
+            (type_id, region_id) = key
+            book = self.snapshot_region(region_id, expire=expire)
+            return book.for_type(type_id)
+        return OrderBook.from_orders(self._orders_for_key(key, expire))
 
-        return self._orders.get(key, [])
+    def _region_of(self, location):
+        region_id = self.universe.locations.region_of(location.id)
+        if region_id is None:
+            raise LookupError(f"No region known for location {location}")
+        return region_id
 
-    def get_for_regions(self, entity, regions, expire=None):
+    # The `get_book_*` methods return `OrderBook`s, straight from the region
+    # snapshots when `bulk` is on; the `get_*` methods return ESI order dicts
+
+    def get_book_for_station(self, entity, station, expire=None):
+        """Orders for `entity` in the region of `station`."""
+        expire = expire or self.default_expire
+        return self._book_for_key((entity.id, self._region_of(station)), expire)
+
+    def get_book_at_location(self, entity, location, expire=None):
+        """Orders for `entity` at a single station, from a region snapshot."""
+        expire = expire or self.default_expire
+        region_id = self._region_of(location)
+        orders = self.snapshot_region(region_id, expire=expire).for_type(entity.id)
+        return orders.where(orders.location_id == location.id)
+
+    def get_book_for_regions(self, entity, regions, expire=None):
         expire = expire or self.default_expire
-        for region in regions:
-            key = (entity.id, region.id)
+        return OrderBook.concat(
+            self._book_for_key((entity.id, region.id), expire)
+            for region in regions
+        )
 
-            if key not in self._orders:
-                seq = orders_for_item(self.requester, [region.id], entity.id)
-                self._orders.set(key, list(seq), expire=expire)
+    def get_for_station(self, entity, station, expire=None):
+        if self.bulk:
+            return self.get_book_for_station(entity, station, expire).to_orders()
+        expire = expire or self.default_expire
+        return self._orders_for_key((entity.id, self._region_of(station)), expire)
 
-        keys = [(entity.id, region.id) for region in regions]
+    def get_at_location(self, entity, location, expire=None):
+        return self.get_book_at_location(entity, location, expire).to_orders()
+
+    def get_for_regions(self, entity, regions, expire=None):
+        if self.bulk:
+            return self.get_book_for_regions(entity, regions, expire).to_orders()
+        expire = expire or self.default_expire
         return list(
-            itertools.chain.from_iterable(self._orders[k] for k in keys)
+            itertools.chain.from_iterable(
+                self._orders_for_key((entity.id, region.id), expire)
+                for region in regions
+            )
+        )
+
+
+def _issued(timestamp):
+    # ESI timestamps look like 2024-05-01T12:34:56Z; numpy wants no zone
+    return np.datetime64(timestamp.rstrip("Z"), "s")
+
+
+class OrderBook:
+    """
+    Column store of market orders.
+
+    Instead of a list of ESI order dicts, each field is kept in its own NumPy
+    array, all aligned by position.  Filters become vectorized masks, and
+    slices (`where`, `take`, `for_type`, ...) return new `OrderBook` objects
+    over the selected rows without building any dicts.
+
+    Sort indexes on `type_id` and `location_id` are computed lazily on first
+    use and cached, so repeated per-type or per-location lookups are binary
+    searches rather than scans.  `groupby` uses the same indexes to split the
+    book into contiguous groups.
+    """
+
+    columns = {
+        "order_id": np.int64,
+        "type_id": np.int64,
+        "location_id": np.int64,
+        "system_id": np.int64,
+        "price": np.float64,
+        "volume_remain": np.int64,
+        "volume_total": np.int64,
+        "min_volume": np.int64,
+        "is_buy": np.bool_,
+        "issued": "datetime64[s]",
+        "duration": np.int64,
+        "range": np.str_,
+    }
+
+    # Fields of an ESI order dict, by column name, where they differ
+    _esi_fields = {"is_buy": "is_buy_order"}
+
+    # Structure market orders don't carry a system id; the rest only matter
+    # for round-tripping through `to_orders`
+    _defaults = {
+        "system_id": 0,
+        "order_id": 0,
+        "min_volume": 1,
+        "duration": 0,
+        "range": "region",
+    }
+
+    @classmethod
+    def from_orders(cls, orders):
+        orders = orders if isinstance(orders, (list, tuple)) else list(orders)
+        arrays = {}
+        for (column, dtype) in cls.columns.items():
+            field = cls._esi_fields.get(column, column)
+            if column == "issued":
+                values = [_issued(x[field]) for x in orders]
+            elif column in cls._defaults:
+                default = cls._defaults[column]
+                values = [x.get(field, default) for x in orders]
+            else:
+                values = [x[field] for x in orders]
+            arrays[column] = np.array(values, dtype=dtype)
+        return cls(**arrays)
+
+    @classmethod
+    def concat(cls, books):
+        books = list(books)
+        if not books:
+            return cls.empty()
+        return cls(
+            **{
+                column: np.concatenate([book._arrays[column] for book in books])
+                for column in cls.columns
+            }
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            **{
+                column: np.array([], dtype=dtype)
+                for (column, dtype) in cls.columns.items()
+            }
         )
 
+    def __init__(self, **arrays):
+        missing = set(self.columns) - set(arrays)
+        if missing:
+            raise TypeError(f"Missing order book columns: {missing}")
+        self._arrays = arrays
+        self._indexes = {}
+
+    def __getattr__(self, attr):
+        try:
+            return self.__dict__["_arrays"][attr]
+        except KeyError:
+            raise AttributeError(attr)
+
+    def __len__(self):
+        return len(self._arrays["price"])
+
+    def __repr__(self):
+        return f"<OrderBook (size: {len(self)})>"
+
+    def take(self, indices):
+        return type(self)(
+            **{
+                column: array[indices]
+                for (column, array) in self._arrays.items()
+            }
+        )
+
+    def where(self, mask):
+        return self.take(np.flatnonzero(mask))
+
+    def buy(self):
+        return self.where(self.is_buy)
+
+    def sell(self):
+        return self.where(~self.is_buy)
+
+    def _index(self, column):
+        if column not in self._indexes:
+            order = np.argsort(self._arrays[column], kind="stable")
+            keys = self._arrays[column][order]
+            self._indexes[column] = (order, keys)
+        return self._indexes[column]
+
+    def _lookup(self, column, value):
+        (order, keys) = self._index(column)
+        lo = np.searchsorted(keys, value, side="left")
+        hi = np.searchsorted(keys, value, side="right")
+        return self.take(order[lo:hi])
+
+    def indexed(self, *columns):
+        """Build the sort indexes on `columns` now, rather than on first use."""
+        for column in columns:
+            self._index(column)
+        return self
+
+    def for_type(self, type_id):
+        return self._lookup("type_id", type_id)
+
+    def for_location(self, location_id):
+        return self._lookup("location_id", location_id)
+
+    def groupby(self, column):
+        """Yield `(value, OrderBook)` pairs for each distinct `column` value."""
+        (order, keys) = self._index(column)
+        if len(keys) == 0:
+            return
+        bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = np.concatenate([[0], bounds])
+        ends = np.concatenate([bounds, [len(keys)]])
+        for (start, end) in zip(starts, ends):
+            yield (keys[start].item(), self.take(order[start:end]))
+
+    def as_series(self, weight_key="volume_total"):
+        return WeightedSeries(self.price, self._arrays[weight_key])
+
+    def to_orders(self):
+        """Materialize the book back into a list of ESI-style order dicts."""
+        fields = {
+            column: self._esi_fields.get(column, column)
+            for column in self.columns
+        }
+        columns = {
+            column: (
+                np.datetime_as_string(array, unit="s").astype(object) + "Z"
+                if column == "issued" else array.tolist()
+            )
+            for (column, array) in self._arrays.items()
+        }
+        return [
+            {fields[column]: columns[column][i] for column in self.columns}
+            for i in range(len(self))
+        ]
+
 
 class EveMarketMetrics:
+    """
+    Order filters and series conversion.
+
+    These accept either a list of ESI order dicts or an `OrderBook`; order
+    books are filtered with vectorized masks and stay order books.
+    """
 
     @classmethod
     def as_series(cls, orders):
+        if isinstance(orders, OrderBook):
+            return orders.as_series()
         return WeightedSeries.from_record_sequence(
             orders,
             value_key="price",
@@ -170,6 +515,8 @@ class EveMarketMetrics:
     def filter_location(cls, location, orders):
         if orders is None:
             return []
+        if isinstance(orders, OrderBook):
+            return orders.where(orders.location_id == location.id)
         return [
             x for x in orders if x["location_id"] == location.id
         ]
@@ -178,12 +525,16 @@ class EveMarketMetrics:
     def filter_buy(cls, orders):
         if orders is None:
             return []
+        if isinstance(orders, OrderBook):
+            return orders.buy()
         return [x for x in orders if x["is_buy_order"]]
 
     @classmethod
     def filter_sell(cls, orders):
         if orders is None:
             return []
+        if isinstance(orders, OrderBook):
+            return orders.sell()
         return [x for x in orders if not x["is_buy_order"]]
 
     @classmethod
@@ -203,6 +554,66 @@ class EveMarketMetrics:
         )
 
 
+class MarketSummary:
+    """
+    Compute many market metrics for many items in one pass.
+
+    `columns` maps an output column name to `(aggregate, side, location)`:
+
+    - `aggregate` is a `weighted_series.SeriesBatch` spec, e.g.
+      `("percentile", 20)` or `("maximum",)`
+    - `side` is "buy" or "sell"
+    - `location` is an entity with an `id`, or None for all locations
+
+    `summarize` takes the orders of every item (a dict of item key to order
+    list or `OrderBook`), stacks them into a single `OrderBook`, and for each
+    distinct `(side, location)` selects the matching orders once with a
+    vectorized mask.  Every metric sharing that selection is then computed
+    for every item at once with a `SeriesBatch`.  Empty selections give None.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.selections = {}
+        for (name, (aggregate, side, location)) in columns.items():
+            location_id = location.id if location is not None else None
+            self.selections.setdefault((side, location_id), {})[name] = aggregate
+
+    def summarize(self, orders_by_key):
+        keys = list(orders_by_key)
+        books = [
+            orders if isinstance(orders, OrderBook)
+            else OrderBook.from_orders(orders or [])
+            for orders in (orders_by_key[k] for k in keys)
+        ]
+        book = OrderBook.concat(books)
+        item = np.repeat(np.arange(len(keys)), [len(b) for b in books])
+
+        results = {}
+        for ((side, location_id), metrics) in self.selections.items():
+            mask = book.is_buy if side == "buy" else ~book.is_buy
+            if location_id is not None:
+                mask = mask & (book.location_id == location_id)
+            batch = SeriesBatch.from_arrays(
+                book.price[mask],
+                book.volume_total[mask],
+                item[mask],
+                len(keys),
+            )
+            results.update(batch.evaluate(metrics))
+
+        return {
+            key: {
+                name: (
+                    None if np.isnan(results[name][i])
+                    else results[name][i].item()
+                )
+                for name in self.columns
+            }
+            for (i, key) in enumerate(keys)
+        }
+
+
 class OrderCalc:
 
     def __init__(self, broker_fee_percent=3, accounting_level=0):
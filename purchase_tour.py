@@ -1,22 +1,30 @@
+import asyncio
 import itertools
-import pickle
+import weakref
 
 import diskcache
 import networkx as nx
-from requests.exceptions import HTTPError
+import numpy as np
 from cytoolz import groupby
 from cytoolz import topk
 
 from hxxp import DefaultHandlers
+from hxxp import iter_pages
+from hxxp import aiter_pages
 
 from astar import state_astar
+from market import orders_params
+from system_graph import UNREACHABLE
+from system_graph import SystemGraph
 
 from timer import Timer
-from util import upper_triangle
 
 
 cache = diskcache.Cache("meve_cache")
 
+IN_SYSTEM_TRAVEL_SECONDS = 30
+JUMP_SECONDS = 60
+
 _json = DefaultHandlers.raise_or_return_json
 
 
@@ -58,111 +66,199 @@ class Purchase:
         )
 
 
-class State:
+class TourBounds:
+    """
+    Precomputed lower bounds on the cost of finishing a purchase tour.
+
+    Whatever is still required has to be bought for at least its best price
+    anywhere, and every item still required has to be picked up at some
+    market selling enough of it before travelling on to `end`.  So from
+    `position`, the remaining travel is at least the distance to `end`, and
+    at least the shortest detour to `end` through a seller of each remaining
+    item.  Both bounds are admissible (and consistent), so A* stays optimal.
+
+    `seconds` holds the travel time between every pair of `positions`.  The
+    bounds are lists indexed like `positions`.
+    """
+
+    def __init__(self, positions, seconds, markets, best_prices, required, end):
+        self.best_prices = best_prices
+        self.to_end = seconds[:, positions.index(end)]
+        self.via_seller = {}
+        for (amount, item) in required:
+            sellers = [
+                i for (i, where) in enumerate(positions)
+                if item in markets.get(where, {})
+                and markets[where][item]["volume_remain"] >= amount
+            ]
+            if sellers:
+                detours = seconds[:, sellers] + self.to_end[sellers]
+                self.via_seller[(amount, item)] = detours.min(axis=1)
+            else:
+                self.via_seller[(amount, item)] = np.full(len(positions), np.inf)
+
+    def purchase_cost(self, required):
+        return sum(
+            amount * self.best_prices[item] for (amount, item) in required
+        )
+
+
+def market_seconds(positions, distances):
+    """Travel seconds between every pair of `(system, station)` positions."""
+    systems = np.array([sys for (sys, _) in positions], dtype=np.int64)
+    jumps = distances.submatrix(systems).astype(np.float64)
+    seconds = np.where(jumps == UNREACHABLE, np.inf, jumps*JUMP_SECONDS)
+    # By system id rather than by jumps, which are unreachable for stations
+    # in a system the matrix doesn't cover
+    same_system = systems[:, None] == systems[None, :]
+    seconds[same_system] = IN_SYSTEM_TRAVEL_SECONDS
+    np.fill_diagonal(seconds, 0)
+    return seconds
+
+
+def graph_seconds(graph, positions):
+    """Travel seconds between every pair of `positions`, through `graph`."""
+    lengths = dict(nx.all_pairs_dijkstra_path_length(graph))
+    return np.array(
+        [
+            [lengths.get(a, {}).get(b, np.inf) for b in positions]
+            for a in positions
+        ],
+        dtype=np.float64,
+    )
+
+
+class TourProblem:
+    """
+    Shared, read-only context of one purchase-tour search.
+
+    Search states are plain `(position, outstanding)` tuples: `position`
+    indexes `self.positions`, and bit `i` of the `outstanding` integer is set
+    while `self.required[i]` still has to be bought.  Everything a state used
+    to carry around (the graph, the inventories, the prices) lives here once,
+    flattened into per-position lists, so states are cheap to create and hash.
+
+    Transitions are likewise tuples during the search and only turned into
+    `Purchase` and `Travel` for the final path.
+    """
 
     def __init__(
         self,
         graph,
         markets,
         best_prices,
-        position,
-        required=None,
+        required,
+        start,
+        end,
         move_cost_per_second=4160,
+        distances=None,
     ):
-        self.graph = graph
-        self.markets = markets
-        self.best_prices = best_prices
-        self.position = position
-        self.required = required if required is not None else set([])
+        unsold = sorted(item for (_, item) in required if item not in best_prices)
+        if unsold:
+            raise ValueError(f"No candidate market sells items {unsold}")
+
+        self.positions = list(graph.nodes)
+        for pos in [start, end]:
+            if pos not in graph:
+                self.positions.append(pos)
+        self.index = {pos: i for (i, pos) in enumerate(self.positions)}
+        self.required = sorted(required)
         self.move_cost_per_second = move_cost_per_second
 
-    def __eq__(self, other):
-        return (
-            self.position == other.position
-            and self.required == other.required
+        # Per position: what can be bought there, and where one can move
+        self.purchases = [[] for _ in self.positions]
+        self.moves = [[] for _ in self.positions]
+        for (i, pos) in enumerate(self.positions):
+            inventory = markets.get(pos, {})
+            for (bit, (amount, item)) in enumerate(self.required):
+                if (
+                    item in inventory
+                    and inventory[item]["volume_remain"] >= amount
+                ):
+                    cost = amount * inventory[item]["price"]
+                    self.purchases[i].append((1 << bit, bit, cost))
+            if pos in graph:
+                for n in graph.neighbors(pos):
+                    jump_seconds = graph.get_edge_data(pos, n)["weight"]
+                    cost = jump_seconds*move_cost_per_second
+                    self.moves[i].append((self.index[n], cost))
+
+        # Heuristic terms, see `TourBounds`.  Travel times come straight
+        # from the jump distances if we have them.
+        seconds = (
+            market_seconds(self.positions, distances) if distances is not None
+            else graph_seconds(graph, self.positions)
         )
-
-    def __hash__(self):
-        return hash((self.position, tuple(sorted(self.required))))
-
-    def __repr__(self):
-        return f"{self.position}={self.required}"
-
-    def transition(self, x):
-        defaults = {
-            "graph": self.graph,
-            "markets": self.markets,
-            "best_prices": self.best_prices,
-            "move_cost_per_second": self.move_cost_per_second,
-            "position": self.position,
-            "required": self.required,
-        }
-        if isinstance(x, Purchase):
-            return type(self)(
-                **{
-                    **defaults,
-                    "required": self.required.difference({x.what}),
-                },
-            )
-
-        elif isinstance(x, Travel):
-            return type(self)(
-                **{
-                    **defaults,
-                    "position": x.dest,
-                },
-            )
-
-        else:
-            raise ValueError(f"Unknown transition for {type(self)}: {x}")
-
-    def neighbors(self):
+        bounds = TourBounds(
+            self.positions,
+            seconds,
+            markets,
+            best_prices,
+            required,
+            end,
+        )
+        self.min_purchase = [
+            amount * best_prices[item] for (amount, item) in self.required
+        ]
+        self.to_end = (bounds.to_end*move_cost_per_second).tolist()
+        self.via_seller = [
+            (bounds.via_seller[r]*move_cost_per_second).tolist()
+            for r in self.required
+        ]
+
+        self.initial = (self.index[start], (1 << len(self.required)) - 1)
+        self.final = (self.index[end], 0)
+
+    def neighbors(self, state):
+        (position, outstanding) = state
         # Purchase from current station
-        for (amount, item) in self.required:
-            # Skip if this station doesn't have the item
-            if (
-                self.position not in self.markets
-                or item not in self.markets[self.position]
-                or self.markets[self.position][item]["volume_remain"] < amount
-            ):
-                continue
-            cost = amount * self.markets[self.position][item]["price"]
-            transition = Purchase((amount, item), self.position, cost)
-            state = self.transition(transition)
-            yield (transition, state, cost)
-
+        for (mask, bit, cost) in self.purchases[position]:
+            if outstanding & mask:
+                yield (
+                    (position, bit, cost),
+                    (position, outstanding & ~mask),
+                    cost,
+                )
         # Move to an adjacent station
-        for n in self.graph.neighbors(self.position):
-            jump_seconds = self.graph.get_edge_data(self.position, n)["weight"]
-            cost = jump_seconds*self.move_cost_per_second
-            transition = Travel(n, cost)
-            state = self.transition(transition)
-            yield (transition, state, cost)
-
-    def heuristic(self, goal):
-        return 0
-        # This performs WORSE than just not putting a heuristic in
-        min_buy_cost = sum(
-            amount * self.best_prices[item]
-            for (amount, item) in self.required
+        for (n, cost) in self.moves[position]:
+            yield ((n, None, cost), (n, outstanding), cost)
+
+    def heuristic(self, state, goal):
+        (position, outstanding) = state
+        purchase = 0
+        travel = self.to_end[position]
+        while outstanding:
+            low = outstanding & -outstanding
+            bit = low.bit_length() - 1
+            purchase += self.min_purchase[bit]
+            travel = max(travel, self.via_seller[bit][position])
+            outstanding ^= low
+        return purchase + travel
+
+    def solve(self, trace=None):
+        (total_cost, path) = state_astar(
+            self.initial,
+            self.final,
+            self.neighbors,
+            self.heuristic,
+            trace=trace,
         )
-        min_path = nx.shortest_path(self.graph, self.position, goal.position)
-        path_seconds = sum(
-            self.graph.get_edge_data(a, b)["weight"]
-            for (a, b) in zip(min_path, min_path[1:])
-        )
-        travel_cost = path_seconds*self.move_cost_per_second
-        return min_buy_cost + travel_cost
+        return (total_cost, self._procedure(path))
+
+    def _procedure(self, steps):
+        procedure = []
+        for (position, bit, cost) in steps:
+            where = self.positions[position]
+            if bit is None:
+                procedure.append(Travel(where, cost))
+            else:
+                procedure.append(Purchase(self.required[bit], where, cost))
+        return procedure
 
 
 # FIXME: should maybe move this
 def load_system_graph(path):
-    graph = nx.Graph()
-    with open(path, "rb") as f:
-        graph_data = pickle.load(f)
-    for edge in graph_data["edges"]:
-        graph.add_edge(*edge)
-    return graph
+    return SystemGraph.load_or_build(path)
 
 
 def get_orders(r, query, region_id, type_id=None, page=1):
@@ -178,33 +274,165 @@ def get_orders(r, query, region_id, type_id=None, page=1):
 
 
 def iter_orders(r, query, region_id, type_id=None):
-    page = 1
-    while True:
-        try:
-            yield from get_orders(
-                r,
-                query,
-                region_id=region_id,
-                type_id=type_id,
-                page=page,
-            )
-            page += 1
-        except HTTPError:
+    pages = iter_pages(
+        r,
+        "GET",
+        f"/markets/{region_id}/orders",
+        params=orders_params(query, type_id),
+    )
+    for res in pages:
+        if res.status_code == 404:
+            return
+        yield from _json(res)
+
+
+async def aiter_orders(r, query, region_id, type_id=None):
+    pages = aiter_pages(
+        r,
+        "GET",
+        f"/markets/{region_id}/orders",
+        params=orders_params(query, type_id),
+    )
+    async for res in pages:
+        if res.status_code == 404:
             return
+        for entry in _json(res):
+            yield entry
+
 
+async def aorders_in_regions(requester, region_ids, item_ids, query=None):
+    query = query or {"order_type": "all"}
 
-_routes = {}
+    async def _orders(region_id, item_id):
+        return [
+            entry async for entry in
+            aiter_orders(requester, query, region_id, int(item_id))
+        ]
+
+    results = await asyncio.gather(
+        *(
+            _orders(region_id, item_id)
+            for item_id in item_ids
+            for region_id in region_ids
+        )
+    )
+    return list(itertools.chain.from_iterable(results))
+
+
+class RouteCache:
+    """
+    Shortest routes through a `SystemGraph`, persisted across runs.
+
+    Rather than individual routes, the cache keeps the BFS predecessor tree
+    of every source it has searched from: a single int32 array giving, for
+    each system, the previous system on a shortest route from the source.
+    Any route from that source (or, reversed, to it) is then read off the
+    tree without searching again.
+
+    Trees are stored in `store` under the graph's content hash, so changing
+    the graph (re-crawling `graph.pkl`) never returns stale routes.  The
+    store only keeps trees for the most recent graph: opening a cache for a
+    new graph evicts everything stored under the previous one.
+    """
+
+    _instances = weakref.WeakKeyDictionary()
+    _digest_key = ("route_tree_digest",)
+
+    def __init__(self, system_graph, store=None):
+        """Initialize the instance."""
+        # Weakly, or `_instances` would keep every graph it has seen alive
+        self._graph = weakref.ref(system_graph)
+        self.store = store if store is not None else cache
+        self.digest = system_graph.digest()
+        self._trees = {}
+        self._evict_stale()
+
+    @staticmethod
+    def _tag(digest):
+        return f"route_tree:{digest}"
+
+    def _evict_stale(self):
+        previous = self.store.get(self._digest_key)
+        if previous == self.digest:
+            return
+        if previous is not None:
+            self.store.evict(self._tag(previous))
+        self.store.set(self._digest_key, self.digest)
+
+    @property
+    def graph(self):
+        graph = self._graph()
+        if graph is None:
+            raise ReferenceError("The graph of this RouteCache is gone")
+        return graph
+
+    @classmethod
+    def for_graph(cls, system_graph):
+        if system_graph not in cls._instances:
+            cls._instances[system_graph] = cls(system_graph)
+        return cls._instances[system_graph]
+
+    def _key(self, source):
+        return ("route_tree", self.digest, source)
+
+    def cached_tree(self, source):
+        if source not in self._trees:
+            tree = self.store.get(self._key(source))
+            if tree is None:
+                return None
+            self._trees[source] = tree
+        return self._trees[source]
+
+    def tree(self, source):
+        tree = self.cached_tree(source)
+        if tree is None:
+            (_, tree) = self.graph.bfs(source)
+            self.store.set(self._key(source), tree, tag=self._tag(self.digest))
+            self._trees[source] = tree
+        return tree
+
+    def _walk(self, tree, source, target):
+        """Route from `target` back to `source` along `tree`."""
+        index = self.graph.index
+        (start, i) = (index[source], index[target])
+        path = [i]
+        while i != start:
+            i = int(tree[i])
+            if i < 0:
+                raise nx.NetworkXNoPath(f"No route from {source} to {target}")
+            path.append(i)
+        return self.graph.ids[path].tolist()
+
+    def route(self, first, last):
+        """A shortest route from `first` to `last`, both ends included."""
+        for node in [first, last]:
+            if node not in self.graph:
+                raise nx.NodeNotFound(f"{node} is not in the graph")
+        # A tree already searched from the far end serves just as well
+        if self.cached_tree(first) is None and self.cached_tree(last) is not None:
+            return self._walk(self.tree(last), last, first)
+        return self._walk(self.tree(first), first, last)[::-1]
 
 
-@cache.memoize(ignore={0})
 def get_route(system_graph, first, last):
-    if (first, last) in _routes:
-        return _routes[(first, last)]
-    elif (last, first) in _routes:
-        return reversed(_routes[(last, first)])
-    else:
-        _routes[(first, last)] = nx.shortest_path(system_graph, first, last)
-        return _routes[(first, last)]
+    return RouteCache.for_graph(system_graph).route(first, last)
+
+
+def travel_routes(system_graph, start_position, procedure):
+    """
+    Yield `(entry, systems)` for each entry of `procedure`.
+
+    For a `Travel`, `systems` is its jump route, starting from the system the
+    previous move (or `start_position`) ended in; for anything else, None.
+    """
+    (system, _) = start_position
+    for entry in procedure:
+        if isinstance(entry, Travel):
+            (dest_system, _) = entry.dest
+            yield (entry, get_route(system_graph, system, dest_system))
+            system = dest_system
+        else:
+            yield (entry, None)
 
 
 def orders_for_item(requester, region_ids, item_id):
@@ -388,63 +616,43 @@ def item_to_location_candidates(
     return sorted_by_location
 
 
-def compute_graph(system_graph, markets):
-    in_system_travel_seconds = 30
-    jump_seconds = 60
+def compute_graph(system_graph, markets, timer=None):
+    """
+    Graph of the markets, with travel times between them.
+
+    Markets in the same system are connected directly.  Markets in different
+    systems are connected if no other market system lies on a shortest route
+    between them, weighted by the jumps along that route; travelling between
+    any two markets through the graph then takes exactly as long as the
+    shortest route.
 
-    system_set = {}
-    for (sys, mkt) in markets:
-        system_set[sys] = system_set.get(sys, []) + [(sys, mkt)]
+    Both the jumps and the market systems lying along the routes come out of
+    a single multi-source search of the `SystemGraph` from every market
+    system, rather than a route per pair.
+    """
+    timer = timer or Timer()
+    by_system = groupby(lambda m: m[0], markets)
+    # Systems we haven't crawled are unreachable from everything else
+    systems = [s for s in by_system if s in system_graph]
 
+    timer.checkpoint("Search from market systems")
+    (jumps, through) = system_graph.multi_source_bfs(systems)
+
+    timer.checkpoint("Connect markets")
     g = nx.Graph()
-    for (m1, m2) in upper_triangle(markets):
-        (sys1, mkt1) = m1
-        (sys2, mkt2) = m2
-
-        # In-system travel is a special case
-        if sys1 == sys2:
-            g.add_edge(m1, m2, weight=in_system_travel_seconds)
-            continue
-
-        # Travel between systems
-        route = iter(get_route(system_graph, sys1, sys2))
-
-        # Routes can include other systems than just sys1 and sys2, so
-        # this isn't necessarily telling us directly about the
-        # connectivity between sys1 and sys2.  We need to walk the
-        # route, counting jumps through systems we don't care about,
-        # until whenever we encounter one of the systems we care about
-        # (systems in system_set) we record that edge length.
-        #
-        # That is, a single route between two systems might give us
-        # multiple edges in our graph of nodes we actually care about.
-        #
-        # Because these routes are guaranteed by get_route() to be the
-        # SHORTEST routes, we will never clobber an edge with a
-        # different weight, it will always be the minimum one between
-        # those nodes.
-        #
-        jumps = []
-
-        start = next(route)
-        w = 1
-        for s in route:
-            if s in system_set:
-                jumps.append((start, s, w))
-                w = 1
-                start = s
-            else:
-                w += 1
-
-        # We have found jump connectivity between the systems, but each
-        # system could have multiple markets.  We need to add graph
-        # edges for each market pair between the systems
-        for (left, right, weight) in jumps:
-            left_markets = system_set[left]
-            right_markets = system_set[right]
-            for ml in left_markets:
-                for mr in right_markets:
-                    g.add_edge(ml, mr, weight=weight*jump_seconds)
+    g.add_nodes_from(markets)
+
+    # In-system travel is a special case
+    for in_system in by_system.values():
+        for (m1, m2) in itertools.combinations(in_system, 2):
+            g.add_edge(m1, m2, weight=IN_SYSTEM_TRAVEL_SECONDS)
+
+    adjacent = (jumps > 0) & ~through
+    for (i, j) in zip(*np.nonzero(np.triu(adjacent))):
+        weight = int(jumps[i, j])*JUMP_SECONDS
+        for m1 in by_system[systems[i]]:
+            for m2 in by_system[systems[j]]:
+                g.add_edge(m1, m2, weight=weight)
 
     return g
 
@@ -459,6 +667,7 @@ def optimize_purchase(
     end_position=None,
     timer=None,
     cost_per_second=4160,
+    distances=None,
 ):
     timer = timer or Timer(trace=True)
     end_position = end_position or start_position
@@ -486,34 +695,22 @@ def optimize_purchase(
     markets.add(end_position)
 
     timer.checkpoint("Compute graph")
-    g = compute_graph(system_graph, markets)
+    g = compute_graph(system_graph, markets, timer=timer)
 
     timer.checkpoint("Set up optimization problem")
-    initial = State(
+    problem = TourProblem(
         g,
         inventories,
-        best_prices=best_prices,
-        position=start_position,
-        required=required,
-        move_cost_per_second=cost_per_second,
-    )
-    final = State(
-        g,
-        inventories,
-        best_prices=best_prices,
-        position=end_position,
-        required=set([]),
+        best_prices,
+        required,
+        start_position,
+        end_position,
         move_cost_per_second=cost_per_second,
+        distances=distances,
     )
 
     timer.checkpoint("Perform A*")
-    (total_cost, procedure) = state_astar(
-        initial,
-        final,
-        State.neighbors,
-        State.heuristic,
-        trace=timer.checkpoint,
-    )
+    (total_cost, procedure) = problem.solve(trace=timer.checkpoint)
 
     timer.checkpoint("Complete")
     return (total_cost, procedure)
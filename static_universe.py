@@ -0,0 +1,382 @@
+import json
+import os
+import sqlite3
+import threading
+
+import click
+
+
+DEFAULT_PATH = "static_universe.sqlite"
+
+
+#
+# Reading the static data export
+#
+
+
+def _lines(sde_dir, name):
+    path = os.path.join(sde_dir, f"{name}.jsonl")
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _name(value):
+    # Localized fields are dicts keyed by language
+    if isinstance(value, dict):
+        return value.get("en")
+    return value
+
+
+def _key(record, *alternatives):
+    for key in ("_key",) + alternatives:
+        if key in record:
+            return int(record[key])
+    raise KeyError(f"No id among {alternatives} in {record}")
+
+
+def _position(record):
+    position = record.get("position")
+    if isinstance(position, dict):
+        return {k: position.get(k) for k in ["x", "y", "z"]}
+    elif isinstance(position, (list, tuple)):
+        return dict(zip(["x", "y", "z"], position))
+    else:
+        return None
+
+
+def _roman(n):
+    numerals = [
+        (10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I"),
+    ]
+    out = ""
+    for (value, numeral) in numerals:
+        while n >= value:
+            out += numeral
+            n -= value
+    return out
+
+
+def _station_names(sde_dir, systems):
+    """
+    Compose station names the way the game does.
+
+    The export doesn't name NPC stations; the name is the celestial they orbit
+    ("Jita IV - Moon 4"), the owner corporation, and optionally the station
+    operation ("Caldari Navy Assembly Plant").
+    """
+    planets = {
+        _key(p, "planetID"): p for p in _lines(sde_dir, "mapPlanets")
+    }
+    moons = {
+        _key(m, "moonID"): m for m in _lines(sde_dir, "mapMoons")
+    }
+    corporations = {
+        _key(c, "corporationID"): _name(c.get("name"))
+        for c in _lines(sde_dir, "npcCorporations")
+    }
+    operations = {
+        _key(o, "operationID"): _name(o.get("operationName"))
+        for o in _lines(sde_dir, "stationOperations")
+    }
+
+    def planet_name(planet_id):
+        planet = planets.get(planet_id)
+        if planet is None:
+            return None
+        system = systems.get(planet.get("solarSystemID"))
+        if system is None or planet.get("celestialIndex") is None:
+            return None
+        return f"{system['name']} {_roman(planet['celestialIndex'])}"
+
+    def celestial_name(celestial_id):
+        if celestial_id in moons:
+            moon = moons[celestial_id]
+            planet = planet_name(moon.get("orbitID"))
+            if planet is None or moon.get("orbitIndex") is None:
+                return None
+            return f"{planet} - Moon {moon['orbitIndex']}"
+        return planet_name(celestial_id)
+
+    def station_name(station):
+        if station.get("name"):
+            return _name(station["name"])
+        orbit = celestial_name(station.get("orbitID"))
+        corporation = corporations.get(station.get("ownerID"))
+        if orbit is None or corporation is None:
+            return None
+        operation = operations.get(station.get("operationID"))
+        if station.get("useOperationName") and operation:
+            return f"{orbit} - {corporation} {operation}"
+        return f"{orbit} - {corporation}"
+
+    return station_name
+
+
+def read_sde(sde_dir):
+    """
+    Yield `(kind, id, name, details)` for every record in a static data export.
+
+    `sde_dir` holds the JSON lines files of the export (`mapRegions.jsonl`,
+    `mapSolarSystems.jsonl`, `types.jsonl`, ...).  The details are shaped like
+    the corresponding ESI `/universe/{kind}s/{id}` responses, so they can
+    stand in for them.
+    """
+    regions = {}
+    constellations = {}
+    systems = {}
+
+    for r in _lines(sde_dir, "mapRegions"):
+        region_id = _key(r, "regionID")
+        regions[region_id] = {
+            "region_id": region_id,
+            "name": _name(r.get("name")),
+            "description": _name(r.get("description")),
+            "constellations": [],
+        }
+
+    for c in _lines(sde_dir, "mapConstellations"):
+        constellation_id = _key(c, "constellationID")
+        constellations[constellation_id] = {
+            "constellation_id": constellation_id,
+            "name": _name(c.get("name")),
+            "region_id": c.get("regionID"),
+            "position": _position(c),
+            "systems": [],
+        }
+        if c.get("regionID") in regions:
+            regions[c["regionID"]]["constellations"].append(constellation_id)
+
+    for s in _lines(sde_dir, "mapSolarSystems"):
+        system_id = _key(s, "solarSystemID")
+        systems[system_id] = {
+            "system_id": system_id,
+            "name": _name(s.get("name")),
+            "constellation_id": s.get("constellationID"),
+            "security_status": s.get("securityStatus"),
+            "security_class": s.get("securityClass"),
+            "star_id": s.get("starID"),
+            "position": _position(s),
+            "stargates": [],
+            "stations": [],
+        }
+        if s.get("constellationID") in constellations:
+            constellations[s["constellationID"]]["systems"].append(system_id)
+
+    yield from (("region", k, v["name"], v) for (k, v) in regions.items())
+    yield from (
+        ("constellation", k, v["name"], v) for (k, v) in constellations.items()
+    )
+
+    station_name = _station_names(sde_dir, systems)
+    stations = []
+    for s in _lines(sde_dir, "npcStations"):
+        station_id = _key(s, "stationID")
+        system_id = s.get("solarSystemID")
+        stations.append({
+            "station_id": station_id,
+            "name": station_name(s),
+            "system_id": system_id,
+            "type_id": s.get("typeID"),
+            "owner": s.get("ownerID"),
+            "position": _position(s),
+        })
+        if system_id in systems:
+            systems[system_id]["stations"].append(station_id)
+
+    stargates = []
+    for g in _lines(sde_dir, "mapStargates"):
+        stargate_id = _key(g, "stargateID")
+        system_id = g.get("solarSystemID")
+        destination = g.get("destination") or {}
+        destination_system = destination.get("solarSystemID")
+        stargates.append({
+            "stargate_id": stargate_id,
+            "name": (
+                f"Stargate ({systems[destination_system]['name']})"
+                if destination_system in systems else None
+            ),
+            "system_id": system_id,
+            "type_id": g.get("typeID"),
+            "position": _position(g),
+            "destination": {
+                "system_id": destination_system,
+                "stargate_id": destination.get("stargateID"),
+            },
+        })
+        if system_id in systems:
+            systems[system_id]["stargates"].append(stargate_id)
+
+    yield from (("system", k, v["name"], v) for (k, v) in systems.items())
+    yield from (("station", s["station_id"], s["name"], s) for s in stations)
+    yield from (("stargate", g["stargate_id"], g["name"], g) for g in stargates)
+
+    dogma = {
+        _key(d, "typeID"): d for d in _lines(sde_dir, "typeDogma")
+    }
+    for t in _lines(sde_dir, "types"):
+        type_id = _key(t, "typeID")
+        type_dogma = dogma.get(type_id, {})
+        yield (
+            "type",
+            type_id,
+            _name(t.get("name")),
+            {
+                "type_id": type_id,
+                "name": _name(t.get("name")),
+                "description": _name(t.get("description")),
+                "group_id": t.get("groupID"),
+                "market_group_id": t.get("marketGroupID"),
+                "published": t.get("published"),
+                "mass": t.get("mass"),
+                "volume": t.get("volume"),
+                "capacity": t.get("capacity"),
+                "portion_size": t.get("portionSize"),
+                "dogma_attributes": [
+                    {"attribute_id": a["attributeID"], "value": a["value"]}
+                    for a in type_dogma.get("dogmaAttributes", [])
+                ],
+                "dogma_effects": [
+                    {"effect_id": e["effectID"], "is_default": e["isDefault"]}
+                    for e in type_dogma.get("dogmaEffects", [])
+                ],
+            },
+        )
+
+
+#
+# Store
+#
+
+
+class StaticUniverse:
+    """
+    Local, indexed store of static universe records.
+
+    Records are ESI-shaped details keyed by `(kind, id)`, with an index on
+    name, kept in SQLite.  `UniverseLookup` consults the store before going to
+    ESI, so anything covered by the static data export never needs a request.
+    """
+
+    @classmethod
+    def if_present(cls, path=DEFAULT_PATH):
+        return cls(path) if os.path.exists(path) else None
+
+    @classmethod
+    def build(cls, records, path=DEFAULT_PATH):
+        # Build into a scratch file and swap it in, so readers never see a
+        # partial import
+        tmp = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        conn = sqlite3.connect(tmp)
+        with conn:
+            conn.execute(
+                "CREATE TABLE records ("
+                "kind TEXT, id INTEGER, name TEXT, data TEXT, "
+                "PRIMARY KEY (kind, id))"
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                (
+                    (kind, id_, name, json.dumps(data))
+                    for (kind, id_, name, data) in records
+                ),
+            )
+            conn.execute("CREATE INDEX records_name ON records (name)")
+            conn.execute("CREATE INDEX records_id ON records (id)")
+        conn.close()
+        os.replace(tmp, path)
+        return cls(path)
+
+    def __init__(self, path=DEFAULT_PATH):
+        """Initialize the instance."""
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        # SQLite connections can't be shared between threads
+        if not hasattr(self._local, "conn"):
+            self._local.conn = sqlite3.connect(
+                f"file:{self.path}?mode=ro",
+                uri=True,
+            )
+        return self._local.conn
+
+    def details(self, kind, id_):
+        row = self.conn.execute(
+            "SELECT data FROM records WHERE kind = ? AND id = ?",
+            (kind, int(id_)),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def kinds_of(self, id_):
+        """Kinds of record stored under `id_`."""
+        return [
+            kind for (kind,) in self.conn.execute(
+                "SELECT kind FROM records WHERE id = ?",
+                (int(id_),),
+            )
+        ]
+
+    def _in(self, column, keys, where="1"):
+        keys = list(keys)
+        # Stay well under SQLite's limit on bound parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            marks = ", ".join("?" * len(chunk))
+            yield from self.conn.execute(
+                f"SELECT id, name FROM records "
+                f"WHERE {column} IN ({marks}) AND {where}",
+                chunk,
+            )
+
+    def names_to_ids(self, names):
+        # Stargate names aren't unique, and ESI doesn't resolve them either
+        return {
+            name: id_
+            for (id_, name) in self._in("name", names, "kind != 'stargate'")
+            if name is not None
+        }
+
+    def ids_to_names(self, ids):
+        return {
+            id_: name for (id_, name) in self._in("id", ids)
+            if name is not None
+        }
+
+    def parents(self, kind, parent_kind):
+        """Yield `(id, parent_id)` for every record of `kind`."""
+        yield from self.conn.execute(
+            "SELECT id, json_extract(data, ?) FROM records WHERE kind = ?",
+            (f"$.{parent_kind}_id", kind),
+        )
+
+    def counts(self):
+        return dict(
+            self.conn.execute("SELECT kind, count(*) FROM records GROUP BY kind")
+        )
+
+
+#
+# Entry point
+#
+
+
+@click.command()
+@click.argument("sde_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("--path", default=DEFAULT_PATH, type=click.Path())
+def cli(sde_dir, path):
+    """Import a static data export (JSON lines) into the local store."""
+    store = StaticUniverse.build(read_sde(sde_dir), path)
+    for (kind, count) in sorted(store.counts().items()):
+        print(f"{kind}: {count}")
+
+
+if __name__ == "__main__":
+    cli()
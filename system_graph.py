@@ -0,0 +1,360 @@
+import hashlib
+import heapq
+import os
+import pickle
+
+import networkx as nx
+import numpy as np
+
+
+UNREACHABLE = -1
+
+
+#
+# Kernels
+#
+
+
+def bfs(indptr, indices, source):
+    """
+    Breadth-first search over CSR adjacency from node index `source`.
+
+    Returns `(distances, predecessors)`: jump counts as int16
+    (`UNREACHABLE` where there is no route) and, for every reached node but
+    the source, the previous node on a shortest route (-1 otherwise).
+    """
+    n = len(indptr) - 1
+    distances = np.full(n, UNREACHABLE, dtype=np.int16)
+    predecessors = np.full(n, -1, dtype=np.int32)
+    distances[source] = 0
+    frontier = np.array([source], dtype=np.int64)
+    level = 0
+    while len(frontier):
+        level += 1
+        starts = indptr[frontier]
+        counts = indptr[frontier + 1] - starts
+        # Every neighbour of the frontier, next to the node it was reached
+        # from, in one gather
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        neighbors = indices[offsets + np.arange(counts.sum())]
+        parents = np.repeat(frontier, counts)
+        new = distances[neighbors] == UNREACHABLE
+        (neighbors, first) = np.unique(neighbors[new], return_index=True)
+        distances[neighbors] = level
+        predecessors[neighbors] = parents[new][first]
+        frontier = neighbors
+    return (distances, predecessors)
+
+
+def dijkstra(indptr, indices, weights, source):
+    """
+    Shortest weighted routes over CSR adjacency from node index `source`.
+
+    `weights` is aligned with `indices`.  Returns `(distances,
+    predecessors)` like `bfs`, with float distances (inf where unreachable).
+    """
+    n = len(indptr) - 1
+    distances = np.full(n, np.inf)
+    predecessors = np.full(n, -1, dtype=np.int32)
+    distances[source] = 0
+    fringe = [(0.0, source)]
+    while fringe:
+        (d, node) = heapq.heappop(fringe)
+        if d > distances[node]:
+            continue
+        for k in range(indptr[node], indptr[node + 1]):
+            n_ = indices[k]
+            found = d + weights[k]
+            if found < distances[n_]:
+                distances[n_] = found
+                predecessors[n_] = node
+                heapq.heappush(fringe, (found, n_))
+    return (distances, predecessors)
+
+
+def _padded(indptr, indices):
+    """
+    Neighbours as an `(n, max_degree)` array, padded with `n`.
+
+    Index `n` is one past the last node, so callers can point it at an
+    always-empty row.
+    """
+    n = len(indptr) - 1
+    degree = np.diff(indptr)
+    width = int(degree.max()) if n else 0
+    padded = np.full((n, width), n, dtype=np.int64)
+    for k in range(width):
+        has = degree > k
+        padded[has, k] = indices[indptr[:-1][has] + k]
+    return padded
+
+
+def _bit_planes_add(planes, mask):
+    """Add `mask` (one bit per counter) to bit-sliced counters, in place."""
+    carry = mask
+    for p in range(len(planes)):
+        (planes[p], carry) = (planes[p] ^ carry, planes[p] & carry)
+
+
+def all_pairs_bfs(indptr, indices, block=4096):
+    """
+    Jump counts between all pairs of nodes, as an int16 matrix.
+
+    Breadth-first searches from up to `block` sources run side by side, one
+    bit per source: `frontier[v]` holds, as a bitset, the sources whose
+    search reached `v` in the last step, so advancing every search by one
+    step is an OR over each node's neighbours.  The distance to `v` from a
+    source is the number of steps after which it still hadn't been reached;
+    those counts are accumulated in bit-sliced counters (bit `p` of every
+    count in plane `p`) and unpacked only once at the end.
+    """
+    n = len(indptr) - 1
+    out = np.empty((n, n), dtype=np.int16)
+    neighbors = _padded(indptr, indices)
+    planes = 15
+
+    for first in range(0, n, block):
+        size = min(block, n - first)
+        words = (size + 63) // 64
+        sources = np.arange(size)
+        # Row n stays empty; it's what padded neighbours point at
+        frontier = np.zeros((n + 1, words), dtype=np.uint64)
+        frontier[first + sources, sources // 64] = (
+            np.uint64(1) << (sources % 64).astype(np.uint64)
+        )
+        visited = frontier.copy()
+        counts = np.zeros((planes, n + 1, words), dtype=np.uint64)
+
+        while True:
+            _bit_planes_add(counts, ~visited)
+            reached = np.zeros_like(frontier)
+            for k in range(neighbors.shape[1]):
+                reached[:n] |= frontier[neighbors[:, k]]
+            reached &= ~visited
+            if not reached.any():
+                break
+            visited |= reached
+            frontier = reached
+
+        def unpack(bits):
+            return np.unpackbits(
+                bits[:n].view(np.uint8),
+                axis=1,
+                bitorder="little",
+            )[:, :size]
+
+        distances = np.zeros((n, size), dtype=np.int16)
+        for p in range(planes):
+            distances |= unpack(counts[p]).astype(np.int16) << p
+        distances[unpack(visited) == 0] = UNREACHABLE
+        out[:, first:first + size] = distances
+
+    return out
+
+
+def _unpack(bits, size):
+    """Bitset rows as a `(rows, size)` bool array."""
+    return np.unpackbits(
+        bits.view(np.uint8),
+        axis=1,
+        bitorder="little",
+    )[:, :size].astype(bool)
+
+
+def multi_source_bfs(indptr, indices, sources):
+    """
+    Jump counts among the `sources` node indices, from one joint search.
+
+    As in `all_pairs_bfs`, a breadth-first search per source runs side by
+    side, one bit each, but only the distances between sources are kept.
+    Along with the frontier every node carries a second bitset, `through`:
+    the searches that reach it by some shortest route passing another source
+    on the way.  Passing a source sets that bit for every search but the
+    source's own.
+
+    Returns `(distances, through)`, `(k, k)` arrays indexed like `sources`:
+    int16 jump counts (`UNREACHABLE` where there is no route), and whether
+    some shortest route between the pair has another source on it.
+    """
+    n = len(indptr) - 1
+    sources = np.asarray(sources, dtype=np.int64)
+    k = len(sources)
+    words = max((k + 63) // 64, 1)
+    neighbors = _padded(indptr, indices)
+
+    bits = np.arange(k)
+    own = np.zeros((k, words), dtype=np.uint64)
+    own[bits, bits // 64] = np.uint64(1) << (bits % 64).astype(np.uint64)
+    # Row n stays empty; it's what padded neighbours point at
+    frontier = np.zeros((n + 1, words), dtype=np.uint64)
+    frontier[sources] = own
+    visited = frontier.copy()
+    through = np.zeros_like(frontier)
+    blocks = np.zeros_like(frontier)
+    blocks[sources] = ~own
+
+    distances = np.full((k, k), UNREACHABLE, dtype=np.int16)
+    np.fill_diagonal(distances, 0)
+    passed = np.zeros((k, k), dtype=bool)
+
+    level = 0
+    while True:
+        level += 1
+        carried = frontier & (through | blocks)
+        reached = np.zeros_like(frontier)
+        onward = np.zeros_like(frontier)
+        for c in range(neighbors.shape[1]):
+            reached[:n] |= frontier[neighbors[:, c]]
+            onward[:n] |= carried[neighbors[:, c]]
+        reached &= ~visited
+        if not reached.any():
+            break
+        # Only bits of searches that just arrived mean anything; `carried`
+        # masks the rest out on the next step
+        through = onward & reached
+        visited |= reached
+        frontier = reached
+
+        arrived = _unpack(reached[sources], k)
+        distances[arrived] = level
+        passed[arrived] = _unpack(through[sources], k)[arrived]
+
+    return (distances, passed)
+
+
+#
+# Graph
+#
+
+
+class SystemGraph:
+    """
+    The stargate graph in compressed sparse row form.
+
+    Systems are numbered by their position in the sorted `ids` array; the
+    neighbours of system `i` are `indices[indptr[i]:indptr[i+1]]`.  Each
+    undirected stargate connection is stored in both directions.
+
+    The arrays are saved as `.npy` files next to the `graph_crawler` pickle
+    and memory-mapped on load, so opening the graph costs next to nothing
+    and the kernels above run on it directly.  `to_networkx` is there for
+    code that still wants a `networkx.Graph`.
+    """
+
+    @classmethod
+    def from_edges(cls, edges):
+        edges = list(edges)
+        pairs = np.array(
+            [(a, b) for (a, b) in edges if a != b],
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        ids = np.unique(np.array(edges, dtype=np.int64).reshape(-1))
+        src = np.searchsorted(ids, np.concatenate([pairs[:, 0], pairs[:, 1]]))
+        dst = np.searchsorted(ids, np.concatenate([pairs[:, 1], pairs[:, 0]]))
+        order = np.lexsort((dst, src))
+        (src, dst) = (src[order], dst[order])
+        keep = np.ones(len(src), dtype=bool)
+        keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        (src, dst) = (src[keep], dst[keep])
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.add.at(indptr, src + 1, 1)
+        return cls(ids, np.cumsum(indptr), dst.astype(np.int32))
+
+    @staticmethod
+    def paths(graph_path):
+        base = os.path.splitext(graph_path)[0]
+        return {
+            name: f"{base}.{name}.npy"
+            for name in ["systems", "indptr", "indices"]
+        }
+
+    @classmethod
+    def load(cls, graph_path):
+        paths = cls.paths(graph_path)
+        return cls(
+            *(np.load(paths[name], mmap_mode="r") for name in paths),
+        )
+
+    @classmethod
+    def is_fresh(cls, graph_path, paths):
+        return all(
+            os.path.exists(p)
+            and os.path.getmtime(p) >= os.path.getmtime(graph_path)
+            for p in paths
+        )
+
+    @classmethod
+    def load_or_build(cls, graph_path):
+        """
+        Graph for the `graph_crawler` pickle at `graph_path`.
+
+        The CSR arrays are rebuilt (and saved) if missing or older than the
+        pickle.
+        """
+        if not cls.is_fresh(graph_path, cls.paths(graph_path).values()):
+            with open(graph_path, "rb") as f:
+                edges = pickle.load(f)["edges"]
+            cls.from_edges(edges).save(graph_path)
+        return cls.load(graph_path)
+
+    def __init__(self, ids, indptr, indices):
+        """Initialize the instance."""
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.index = {id_: i for (i, id_) in enumerate(np.asarray(ids).tolist())}
+
+    def save(self, graph_path):
+        paths = self.paths(graph_path)
+        for (name, array) in [
+            ("systems", self.ids),
+            ("indptr", self.indptr),
+            ("indices", self.indices),
+        ]:
+            np.save(paths[name], np.asarray(array))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, system_id):
+        return system_id in self.index
+
+    def digest(self):
+        """Content hash of the graph."""
+        h = hashlib.sha256()
+        for array in [self.ids, self.indptr, self.indices]:
+            h.update(np.ascontiguousarray(array).tobytes())
+        return h.hexdigest()
+
+    def neighbors(self, system_id):
+        i = self.index[system_id]
+        return self.ids[self.indices[self.indptr[i]:self.indptr[i + 1]]].tolist()
+
+    def edges(self):
+        """Each connection once, as `(system_id, system_id)`."""
+        src = np.repeat(np.arange(len(self.ids)), np.diff(self.indptr))
+        once = src < self.indices
+        ids = np.asarray(self.ids)
+        return zip(
+            ids[src[once]].tolist(),
+            ids[np.asarray(self.indices)[once]].tolist(),
+        )
+
+    def bfs(self, source):
+        return bfs(self.indptr, self.indices, self.index[source])
+
+    def dijkstra(self, source, weights):
+        return dijkstra(self.indptr, self.indices, weights, self.index[source])
+
+    def all_pairs_bfs(self):
+        return all_pairs_bfs(self.indptr, self.indices)
+
+    def multi_source_bfs(self, system_ids):
+        sources = [self.index[s] for s in system_ids]
+        return multi_source_bfs(self.indptr, self.indices, sources)
+
+    def to_networkx(self):
+        graph = nx.Graph()
+        graph.add_nodes_from(np.asarray(self.ids).tolist())
+        graph.add_edges_from(self.edges())
+        return graph
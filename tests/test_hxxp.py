@@ -0,0 +1,24 @@
+import requests
+
+from hxxp import Requester
+
+
+class _Adapter(requests.adapters.BaseAdapter):
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response._content = b"[]"
+        return response
+
+    def close(self):
+        pass
+
+
+def test_requester_accepts_a_bare_session():
+    session = requests.Session()
+    session.mount("https://", _Adapter())
+    requester = Requester("https://esi.example/latest/", session=session)
+    assert requester.request("GET", "/status").json() == []
+    assert requester.stats is None
@@ -0,0 +1,20 @@
+import networkx as nx
+import pytest
+
+from purchase_tour import TourProblem
+
+
+def test_tour_problem_names_items_nobody_sells():
+    (jita, amarr) = ((30000142, 60003760), (30002187, 60008494))
+    graph = nx.Graph()
+    graph.add_edge(jita, amarr, weight=600)
+    markets = {jita: {34: {"price": 5.0, "volume_remain": 1000}}}
+    with pytest.raises(ValueError, match="35"):
+        TourProblem(
+            graph,
+            markets,
+            best_prices={34: 5.0},
+            required={(100, 34), (10, 35)},
+            start=jita,
+            end=jita,
+        )
@@ -0,0 +1,41 @@
+from static_universe import StaticUniverse
+from universe import LRUCache
+from universe import UniverseLookup
+from universe import station_lookup
+
+
+def _static(path):
+    return StaticUniverse.build(
+        [
+            ("region", 10000002, "The Forge", {"region_id": 10000002}),
+            (
+                "system",
+                30000142,
+                "Jita",
+                {
+                    "system_id": 30000142,
+                    "name": "Jita",
+                    "constellation_id": 20000020,
+                    "stations": [60003760],
+                },
+            ),
+            (
+                "station",
+                60003760,
+                "Jita IV - Moon 4 - Caldari Navy Assembly Plant",
+                {"station_id": 60003760, "system_id": 30000142},
+            ),
+        ],
+        str(path),
+    )
+
+
+def test_station_lookup_by_system_name_stays_local(tmp_path, monkeypatch):
+    # The disk caches are created in the working directory
+    monkeypatch.chdir(tmp_path)
+    universe = UniverseLookup(
+        None,
+        memory_cache=LRUCache(),
+        static=_static(tmp_path / "static.sqlite"),
+    )
+    assert station_lookup(universe, "Jita") == (30000142, 60003760)
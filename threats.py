@@ -9,6 +9,7 @@ from bs4 import BeautifulSoup
 
 from formal_vector import FormalVector
 from hxxp import Requester
+from hxxp import esi_scheduler
 from hxxp import DefaultHandlers
 from authentication import EmptyToken
 
@@ -18,7 +19,11 @@ from requests.exceptions import JSONDecodeError
 _json = DefaultHandlers.raise_or_return_json
 
 
-r0 = Requester("https://esi.evetech.net/latest/", EmptyToken())
+r0 = Requester(
+    "https://esi.evetech.net/latest/",
+    EmptyToken(),
+    scheduler=esi_scheduler,
+)
 zk = Requester("https://zkillboard.com", EmptyToken())
 
 
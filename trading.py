@@ -1,6 +1,5 @@
 from concurrent.futures import ThreadPoolExecutor
 from collections import Counter
-from functools import wraps
 import glob
 import itertools
 import datetime
@@ -23,6 +22,8 @@ from industry import MfgMarket
 from market import OrderCalc
 from market import OrderFetcher
 from market import EveMarketMetrics
+from market import MarketSummary
+from market import OrderBook
 
 import sheets as sh
 from sheets import service_login
@@ -101,6 +102,7 @@ order_fetcher = OrderFetcher(
     authed_requester=authed_requester,
     disk_cache="orders1",
     expire=300,
+    bulk=True,
 )
 
 # mfg_dodixie = MfgMarket(
@@ -298,48 +300,6 @@ def pctl(k):
     return _pctl
 
 
-def or_none(func):
-
-    @wraps(func)
-    def _(*args, **kwargs):
-        try:
-            return func(*args, **kwargs)
-        except ValueError:
-            return None
-
-    return _
-
-
-def market_metric(aggregate, buy_sell, location=None):
-    def _(what):
-        if buy_sell == "buy":
-            buy_sell_filter = EveMarketMetrics.filter_buy
-        else:
-            buy_sell_filter = EveMarketMetrics.filter_sell
-
-        if location is not None:
-            candidates = EveMarketMetrics.filter_location(
-                location,
-                buy_sell_filter(what),
-            )
-        else:
-            candidates = buy_sell_filter(what)
-
-        return aggregate(EveMarketMetrics.as_series(candidates))
-
-    return _
-
-
-p1 = or_none(lambda x: WeightedSeriesMetrics.percentile(1, x))
-p10 = or_none(lambda x: WeightedSeriesMetrics.percentile(10, x))
-p20 = or_none(lambda x: WeightedSeriesMetrics.percentile(20, x))
-p80 = or_none(lambda x: WeightedSeriesMetrics.percentile(80, x))
-p90 = or_none(lambda x: WeightedSeriesMetrics.percentile(90, x))
-average = or_none(lambda x: WeightedSeriesMetrics.average(x))
-minimum = or_none(lambda x: WeightedSeriesMetrics.minimum(x))
-maximum = or_none(lambda x: WeightedSeriesMetrics.maximum(x))
-
-
 def relevant_sell(entity):
     orders = order_fetcher.get_for_regions(entity, REGIONS)
     return EveMarketMetrics.as_series(
@@ -374,6 +334,24 @@ def station_buy(station, entity):
     )
 
 
+MARKET_SUMMARY = MarketSummary(
+    {
+        "Jita Sell p1": (("percentile", 1), "sell", jita_44),
+        "Jita Sell p20": (("percentile", 20), "sell", jita_44),
+        "Jita Buy Max": (("maximum",), "buy", jita_44),
+        "Dodixie Sell p1": (("percentile", 1), "sell", dodixie_fed),
+        "Dodixie Sell p20": (("percentile", 20), "sell", dodixie_fed),
+        "Dodixie Buy Max": (("maximum",), "buy", dodixie_fed),
+        "E3O Sell p1": (("percentile", 1), "sell", e3_mothership),
+        "E3O Sell p20": (("percentile", 20), "sell", e3_mothership),
+        "E3O Buy Max": (("maximum",), "buy", e3_mothership),
+        "Zone Sell p1": (("percentile", 1), "sell", None),
+        "Zone Sell p20": (("percentile", 20), "sell", None),
+        "Zone Buy Max": (("maximum",), "buy", None),
+    }
+)
+
+
 class SheetInterface:
 
     def __init__(
@@ -570,10 +548,7 @@ class SheetInterface:
 
         by_id = self._fetch_orders_by_id(product_ids, max_workers=max_workers)
 
-        metrics = {
-            x: self._market_metrics_from_orders(by_id, x)
-            for x in product_ids
-        }
+        metrics = self._market_metrics(by_id)
         result = {}
         for x in metrics:
             for col in metrics[x]:
@@ -596,10 +571,7 @@ class SheetInterface:
             max_workers=max_workers,
         )
 
-        metrics = {
-            ing_id: self._market_metrics_from_orders(by_id, ing_id)
-            for ing_id in ingredient_ids
-        }
+        metrics = self._market_metrics(by_id)
         result = {}
         for ing_id in metrics:
             for col in metrics[ing_id]:
@@ -617,11 +589,9 @@ class SheetInterface:
         with ThreadPoolExecutor(max_workers=max_workers) as exe:
             entity_orders = list(
                 exe.map(
-                    lambda x: list(
-                        self.order_fetcher.get_for_regions(
-                            self.entity.strict.from_id(x),
-                            REGIONS,
-                        ),
+                    lambda x: self.order_fetcher.get_book_for_regions(
+                        self.entity.strict.from_id(x),
+                        REGIONS,
                     ),
                     ids,
                 )
@@ -632,11 +602,9 @@ class SheetInterface:
     def _fetch_orders_by_name(self, names, max_workers=6):
 
         def _orders_for_name(x):
-            result = list(
-                self.order_fetcher.get_for_regions(
-                    self.entity.strict.from_name(x),
-                    REGIONS,
-                )
+            result = self.order_fetcher.get_book_for_regions(
+                self.entity.strict.from_name(x),
+                REGIONS,
             )
             print(".", end="", file=sys.stderr, flush=True)
             return result
@@ -647,7 +615,7 @@ class SheetInterface:
         print("", file=sys.stderr, flush=True)
 
         entity_orders_from_structures = [
-            list(
+            OrderBook.from_orders(
                 itertools.chain.from_iterable(
                     self.order_fetcher.get_for_structure(
                         self.entity.strict.from_name(name),
@@ -659,33 +627,16 @@ class SheetInterface:
             for name in names
         ]
 
-        zone_by_name = dict(zip(names, entity_orders))
-        struct_by_name = dict(zip(names, entity_orders_from_structures))
-
         all_orders = {
-            name: zone_by_name.get(name, []) + struct_by_name.get(name, [])
-            for name in names
+            name: OrderBook.concat([zone, structs])
+            for (name, zone, structs)
+            in zip(names, entity_orders, entity_orders_from_structures)
         }
 
         return all_orders
 
-    def _market_metrics_from_orders(self, lookup, x):
-        metrics = {
-            "Jita Sell p1": market_metric(p1, "sell", location=jita_44),
-            "Jita Sell p20": market_metric(p20, "sell", location=jita_44),
-            "Jita Buy Max": market_metric(maximum, "buy", location=jita_44),
-            "Dodixie Sell p1": market_metric(p1, "sell", location=dodixie_fed),
-            "Dodixie Sell p20": market_metric(p20, "sell", location=dodixie_fed),
-            "Dodixie Buy Max": market_metric(maximum, "buy", location=dodixie_fed),
-            "E3O Sell p1": market_metric(p1, "sell", location=e3_mothership),
-            "E3O Sell p20": market_metric(p20, "sell", location=e3_mothership),
-            "E3O Buy Max": market_metric(maximum, "buy", location=e3_mothership),
-            "Zone Sell p1": market_metric(p1, "sell"),
-            "Zone Sell p20": market_metric(p20, "sell"),
-            "Zone Buy Max": market_metric(maximum, "buy"),
-        }
-        found = lookup.get(x)
-        return {k: metric(found) for (k, metric) in metrics.items()}
+    def _market_metrics(self, lookup):
+        return MARKET_SUMMARY.summarize(lookup)
 
     def update_product_ids_from_names(self):
         names = sh.get_col_range(
@@ -1013,10 +964,14 @@ class SheetInterface:
         mp = self.industry.market_prices()
         entities = self.entity.strict.from_name_seq(names)
         orders = self._fetch_orders_by_name(names, max_workers=6)
+        market_metrics = self._market_metrics(orders)
         metrics = [
             {
                 "Item": entity.name,
-                **self._market_metrics_from_orders(orders, entity.name),
+                **market_metrics.get(
+                    entity.name,
+                    dict.fromkeys(MARKET_SUMMARY.columns),
+                ),
                 "Base Cost": mp["adjusted"][entity.id],
                 "ItemID": entity.id,
             }
@@ -1063,6 +1018,7 @@ class SheetInterface:
         print(f"Found {len(names)} items to check.")
         entities = self.entity.strict.from_name_seq(names)
         orders = self._fetch_orders_by_name(names, max_workers=6)
+        market_metrics = self._market_metrics(orders)
         cost_mapping = {
             1: 400,
             2: 7200,
@@ -1072,7 +1028,10 @@ class SheetInterface:
         metrics = [
             {
                 "Item": entity.name,
-                **self._market_metrics_from_orders(orders, entity.name),
+                **market_metrics.get(
+                    entity.name,
+                    dict.fromkeys(MARKET_SUMMARY.columns),
+                ),
                 "Base Cost": cost_mapping.get(pi_tier(entity)),
             }
             for entity in entities
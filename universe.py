@@ -1,13 +1,23 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import itertools
 import json
 import diskcache
 from functools import wraps
+import mmap
+import os
+import struct
+import tempfile
+import threading
 import time
 
 from cytoolz import mapcat
+import numpy as np
 import requests
 
 from hxxp import DefaultHandlers
+from static_universe import StaticUniverse
 
 
 _json = DefaultHandlers.raise_or_return_json
@@ -21,6 +31,10 @@ def _dbg(x, f, sleep=0):
     return x
 
 
+def _chunks(seq, size):
+    return [seq[i:i+size] for i in range(0, len(seq), size)]
+
+
 def expand_lst(func, pred, lst):
     expanded = lst[:]
     while any(pred(x) for x in expanded):
@@ -74,17 +88,64 @@ class EntityStrictEvaluator:
 
 class EntityFactory:
 
+    def reify(self, struct):
+        # Resolve every pending entity in the structure in bulk first, so the
+        # substitution below only reads already-populated entities
+        self.resolve(self._lazy_entities(struct))
+        return self._substitute(struct)
+
+    @classmethod
+    def _lazy_entities(cls, struct):
+        if isinstance(struct, dict):
+            return list(mapcat(cls._lazy_entities, struct.values()))
+        elif isinstance(struct, (list, tuple)):
+            return list(mapcat(cls._lazy_entities, struct))
+        elif isinstance(struct, LazyEntity):
+            return [struct]
+        else:
+            return []
+
     @classmethod
-    def reify(cls, struct):
+    def _substitute(cls, struct):
         if isinstance(struct, dict):
-            return type(struct)({k: cls.reify(v) for (k, v) in struct.items()})
+            return type(struct)(
+                {k: cls._substitute(v) for (k, v) in struct.items()}
+            )
         elif isinstance(struct, (list, tuple)):
-            return type(struct)([cls.reify(x) for x in struct])
+            return type(struct)([cls._substitute(x) for x in struct])
         elif isinstance(struct, LazyEntity):
             return struct.entity
         else:
             return struct
 
+    def resolve(self, lazy_entities):
+        """
+        Resolve many `LazyEntity` at once.
+
+        Instead of one `/universe/names` or `/universe/ids` call per entity,
+        the pending ids and names are looked up in bulk.  Names the universe
+        doesn't know are searched for as items, like `LazyEntity.entity`
+        does.
+        """
+        pending = [e for e in lazy_entities if not e._entity]
+        by_id = [e for e in pending if e._id]
+        by_name = [e for e in pending if not e._id and e._name]
+
+        if by_id:
+            names = self.universe.ids_to_names({e._id for e in by_id})
+            for e in by_id:
+                e._entity = Entity(entity_id=e._id, name=names[e._id])
+
+        if by_name:
+            ids = self.universe.names_to_ids({e._name for e in by_name})
+            for e in by_name:
+                if e._name in ids:
+                    e._entity = Entity(entity_id=ids[e._name], name=e._name)
+                else:
+                    e._entity = e.items.from_terms(e._name)
+
+        return lazy_entities
+
     def __init__(self, items, universe):
         self.items = items
         self.universe = universe
@@ -167,116 +228,632 @@ class LazyEntity(Entity):
             raise ValueError(self.__dict__)
 
 
+class ItemSearchIndex:
+    """
+    Substring search over item names.
+
+    `ItemFactory.from_terms` matches an item when every whitespace-separated
+    term is a (case-insensitive) substring of its name.  Rather than scanning
+    every name for every lookup, names are lowercased once and indexed by
+    their character trigrams: a name can only contain a term if it contains
+    all the term's trigrams, so intersecting the trigram posting lists of
+    every term (smallest first) leaves a handful of candidates to verify with
+    an actual substring test.  Terms shorter than a trigram can't be indexed;
+    they are only checked during verification.
+
+    Normalized names are also kept in a hash map for exact matches.
+    """
+
+    n = 3
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.lowered = [name.lower() for name in self.names]
+        self.exact = {}
+        postings = {}
+        for (i, name) in enumerate(self.lowered):
+            self.exact.setdefault(name, i)
+            for gram in set(self._grams(name)):
+                postings.setdefault(gram, []).append(i)
+        # Indices are appended in order, so every posting list is sorted
+        self.postings = {
+            gram: np.array(entries, dtype=np.int32)
+            for (gram, entries) in postings.items()
+        }
+
+    def _grams(self, text):
+        return (text[i:i+self.n] for i in range(len(text) - self.n + 1))
+
+    def exact_match(self, terms):
+        i = self.exact.get(terms.lower())
+        return self.names[i] if i is not None else None
+
+    def _term_candidates(self, term):
+        found = None
+        lists = sorted(
+            (self.postings.get(gram, np.array([], dtype=np.int32))
+             for gram in set(self._grams(term))),
+            key=len,
+        )
+        for entries in lists:
+            found = (
+                entries if found is None
+                else np.intersect1d(found, entries, assume_unique=True)
+            )
+            if len(found) == 0:
+                break
+        return found
+
+    def matches(self, terms):
+        """Names containing every term, in catalogue order."""
+        terms = terms.lower().split()
+        candidates = None
+        for term in sorted(terms, key=len, reverse=True):
+            if len(term) < self.n:
+                continue
+            found = self._term_candidates(term)
+            candidates = (
+                found if candidates is None
+                else np.intersect1d(candidates, found, assume_unique=True)
+            )
+            if len(candidates) == 0:
+                return []
+        if candidates is None:
+            candidates = range(len(self.names))
+        return [
+            self.names[i] for i in candidates
+            if all(term in self.lowered[i] for term in terms)
+        ]
+
+
+class TypeCatalogue:
+    """
+    Compiled, memory-mapped form of the `types.json` name -> type id map.
+
+    The file is a fixed header followed by flat arrays, so opening it is just
+    an `mmap`; nothing is parsed up front:
+
+        magic, version, count          (8s, uint32, uint32)
+        ids          int64[count]      type ids, in `types.json` order
+        offsets      uint32[count+1]   name i is names[offsets[i]:offsets[i+1]]
+        sorted_ids   int64[count]      ids, sorted
+        by_id        uint32[count]     entry index for each of sorted_ids
+        by_name      uint32[count]     entry indices ordered by name
+        names        utf-8 blob
+
+    Ids are looked up with a binary search over `sorted_ids`, names with a
+    binary search through `by_name`.  Entries keep the `types.json` order,
+    which is the order search results are reported in.
+
+    Use `TypeCatalogue.open`, which (re)compiles the catalogue next to the
+    JSON file whenever the JSON is newer.
+    """
+
+    magic = b"EVETYPES"
+    version = 1
+    header = struct.Struct("<8sII")
+
+    @classmethod
+    def catalogue_path(cls, json_path):
+        return os.path.splitext(json_path)[0] + ".catalogue"
+
+    @classmethod
+    def open(cls, json_path):
+        path = cls.catalogue_path(json_path)
+        stale = (
+            not os.path.exists(path)
+            or os.path.getmtime(path) < os.path.getmtime(json_path)
+        )
+        if not stale:
+            try:
+                return cls(path)
+            except ValueError:
+                pass
+        cls.compile(json_path, path)
+        return cls(path)
+
+    @classmethod
+    def compile(cls, json_path, path):
+        with open(json_path, "r") as f:
+            # The downloaded repo has strings instead of ints for the type ids
+            entries = [(k, int(v)) for (k, v) in json.load(f).items()]
+        count = len(entries)
+        encoded = [name.encode("utf-8") for (name, _) in entries]
+        ids = np.array([i for (_, i) in entries], dtype=np.int64)
+        offsets = np.zeros(count + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum([len(name) for name in encoded])
+        by_id = np.argsort(ids, kind="stable").astype(np.uint32)
+        by_name = np.array(
+            sorted(range(count), key=encoded.__getitem__),
+            dtype=np.uint32,
+        )
+        # Write next to the destination and swap it in, so a concurrent
+        # reader never sees a half-written catalogue.  The scratch file has a
+        # unique name, as threads of one process may compile at once.
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path) or ".",
+            prefix=f"{os.path.basename(path)}.",
+            suffix=".tmp",
+            delete=False,
+        ) as f:
+            try:
+                f.write(cls.header.pack(cls.magic, cls.version, count))
+                for array in [ids, offsets, ids[by_id], by_id, by_name]:
+                    f.write(array.tobytes())
+                f.write(b"".join(encoded))
+            except BaseException:
+                os.remove(f.name)
+                raise
+        os.replace(f.name, path)
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._buf) < self.header.size:
+            raise ValueError(f"Truncated type catalogue: {path}")
+        (magic, version, count) = self.header.unpack_from(self._buf)
+        if (magic, version) != (self.magic, self.version):
+            raise ValueError(f"Not a type catalogue (v{self.version}): {path}")
+        self.count = count
+        pos = self.header.size
+
+        def take(dtype, size):
+            nonlocal pos
+            array = np.frombuffer(self._buf, dtype=dtype, count=size, offset=pos)
+            pos += array.nbytes
+            return array
+
+        self.ids = take(np.int64, count)
+        self.offsets = take(np.uint32, count + 1)
+        self.sorted_ids = take(np.int64, count)
+        self.by_id = take(np.uint32, count)
+        self.by_name = take(np.uint32, count)
+        self._names_start = pos
+
+    def __len__(self):
+        return self.count
+
+    def _name_bytes(self, i):
+        start = self._names_start + int(self.offsets[i])
+        end = self._names_start + int(self.offsets[i + 1])
+        return self._buf[start:end]
+
+    def name_at(self, i):
+        return self._name_bytes(i).decode("utf-8")
+
+    def names(self):
+        """All names, in catalogue order."""
+        blob = self._buf[self._names_start:].decode("utf-8")
+        # Offsets count bytes, not characters, so split the decoded blob only
+        # when it is pure ASCII
+        if len(blob) == int(self.offsets[-1]):
+            offsets = self.offsets.tolist()
+            return [blob[a:b] for (a, b) in zip(offsets, offsets[1:])]
+        return [self.name_at(i) for i in range(self.count)]
+
+    def id_of(self, name):
+        target = name.encode("utf-8")
+        (lo, hi) = (0, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name_bytes(self.by_name[mid]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            i = self.by_name[lo]
+            if self._name_bytes(i) == target:
+                return int(self.ids[i])
+        raise KeyError(name)
+
+    def name_of(self, entity_id):
+        pos = np.searchsorted(self.sorted_ids, entity_id)
+        if pos < self.count and self.sorted_ids[pos] == entity_id:
+            return self.name_at(self.by_id[pos])
+        raise KeyError(entity_id)
+
+    def items(self):
+        return zip(self.names(), self.ids.tolist())
+
+
 class ItemFactory:
 
     def __init__(self, requester, type_repo_path):
         self.requester = requester
-        with open(type_repo_path, "r") as f:
-            # Fix the types; downloaded repo has strings instead of ints for
-            # the type ids
-            self.type_repo = {k: int(v) for (k, v) in json.load(f).items()}
-        with open(type_repo_path, "r") as f:
-            self.type_repo_rev = {int(v): k for (k, v) in json.load(f).items()}
+        self.type_repo_path = type_repo_path
+        self._catalogue = None
+        self._type_repo = None
+        self._type_repo_rev = None
+        self._index = None
+
+    @property
+    def catalogue(self):
+        # Opened on first use, so importing a module that builds an
+        # `ItemFactory` costs nothing until an item is actually looked up
+        if self._catalogue is None:
+            self._catalogue = TypeCatalogue.open(self.type_repo_path)
+        return self._catalogue
+
+    @property
+    def type_repo(self):
+        if self._type_repo is None:
+            self._type_repo = dict(self.catalogue.items())
+        return self._type_repo
+
+    @property
+    def type_repo_rev(self):
+        if self._type_repo_rev is None:
+            self._type_repo_rev = {v: k for (k, v) in self.catalogue.items()}
+        return self._type_repo_rev
+
+    @property
+    def index(self):
+        # Built on first use; plenty of callers never search by terms
+        if self._index is None:
+            self._index = ItemSearchIndex(self.catalogue.names())
+        return self._index
 
     def from_terms(self, terms):
-        exact = next(
-            (t for t in self.type_repo if terms.lower() == t.lower()),
-            None,
-        )
+        exact = self.index.exact_match(terms)
         if exact:
-            return Entity(entity_id=self.type_repo[exact], name=exact)
+            return Entity(entity_id=self.catalogue.id_of(exact), name=exact)
         else:
-            matches = [
-                t for t in self.type_repo
-                if all(y.lower() in t.lower() for y in terms.split())
-            ]
+            matches = self.index.matches(terms)
             if len(matches) == 0:
                 raise LookupError("No matches.")
             elif len(matches) == 1:
                 t = matches[0]
-                return Entity(entity_id=self.type_repo[t], name=t)
+                return Entity(entity_id=self.catalogue.id_of(t), name=t)
             else:
                 raise LookupError(f"Ambiguous matches for '{terms}' (next line):\n{matches}")
 
     def from_name(self, name):
-        return self.type_repo[name]
+        return self.catalogue.id_of(name)
 
     def from_id(self, entity_id):
-        return self.type_repo_rev[int(entity_id)]
+        return self.catalogue.name_of(int(entity_id))
+
+
+class LRUCache:
+    """
+    Bounded in-memory cache, evicting the least recently used entries.
+
+    Safe to share between threads.  Counts hits and misses.
+    """
+
+    def __init__(self, maxsize=100000):
+        """Initialize the instance."""
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def lookup(self, key):
+        """Return `(True, value)` on a hit, `(False, None)` on a miss."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return (False, None)
+            self._data.move_to_end(key)
+            self.hits += 1
+            return (True, value)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TieredCache:
+    """
+    An `LRUCache` in front of a persistent (disk) cache.
+
+    Reads are served from memory when possible; entries read from disk are
+    promoted into memory.  Writes go to both.  Supports the subset of the
+    `diskcache.Cache` interface `UniverseLookup` uses.
+    """
+
+    _missing = object()
+
+    def __init__(self, memory, disk):
+        """Initialize the instance."""
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        (hit, value) = self.memory.lookup(key)
+        if hit:
+            return value
+        value = self.disk.get(key, default=self._missing)
+        if value is self._missing:
+            return default
+        self.memory.set(key, value)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, default=self._missing) is not self._missing
+
+    def set(self, key, value):
+        self.disk.set(key, value)
+        self.memory.set(key, value)
+
+
+class LocationIndex:
+    """
+    Station -> system -> constellation -> region parents, as plain dicts.
+
+    Walking the hierarchy through `UniverseLookup.details` costs a cache read
+    (or a request) per level.  The index keeps just the parent ids, filled in
+    bulk from the static store when there is one, and otherwise learned from
+    every details lookup `UniverseLookup.chain` makes, so repeated walks are a
+    few dict lookups.
+    """
+
+    hierarchy = {
+        "station": "system",
+        "system": "constellation",
+        "constellation": "region",
+    }
+
+    # ESI id ranges, for telling what kind of location a bare id is
+    id_ranges = [
+        ("region", 10000000, 13000000),
+        ("constellation", 20000000, 23000000),
+        ("system", 30000000, 33000000),
+        ("station", 60000000, 64000000),
+    ]
+
+    def __init__(self, universe):
+        """Initialize the instance."""
+        self.universe = universe
+        self._parents = {kind: {} for kind in self.hierarchy}
+        static = universe.static
+        if static is not None:
+            for (kind, parent_kind) in self.hierarchy.items():
+                self._parents[kind].update(static.parents(kind, parent_kind))
+
+    def parent(self, kind, id_, parent_kind):
+        """Known parent id of `(kind, id_)`, or None."""
+        if self.hierarchy.get(kind) != parent_kind:
+            return None
+        return self._parents[kind].get(id_)
+
+    def learn(self, kind, id_, parent_id):
+        if kind in self._parents and parent_id is not None:
+            self._parents[kind][id_] = parent_id
+
+    def kind_of(self, id_):
+        for (kind, lower, upper) in self.id_ranges:
+            if lower <= id_ < upper:
+                return kind
+        return None
+
+    def region_of(self, location_id):
+        """
+        Region id of a station, system or constellation id.
+
+        None for ids outside the public hierarchy (player structures).
+        """
+        kind = self.kind_of(location_id)
+        found = location_id
+        while kind is not None and kind != "region":
+            parent_kind = self.hierarchy[kind]
+            parent = self.parent(kind, found, parent_kind)
+            if parent is None:
+                details = self.universe.details(kind, entity_id=found)
+                parent = details.get(f"{parent_kind}_id")
+                if parent is None:
+                    return None
+                self.learn(kind, found, parent)
+            (kind, found) = (parent_kind, parent)
+        return found if kind == "region" else None
+
+    def regions_for(self, locations):
+        """Region ids for many locations (entities or ids), in order."""
+        return [
+            self.region_of(getattr(location, "id", location))
+            for location in locations
+        ]
+
+
+# One memory tier per process, shared by every `UniverseLookup`.  Resize with
+# `universe_memory_cache.resize(n)`.
+universe_memory_cache = LRUCache()
 
 
 class UniverseLookup:
 
-    def __init__(self, requester):
+    def __init__(
+        self,
+        requester,
+        async_requester=None,
+        response_cache=None,
+        memory_cache=None,
+        static=UNSET,
+    ):
+        if response_cache is not None:
+            requester = requester.cached(response_cache)
         self.requester = requester
-        self.cache = diskcache.Cache("eve_universe_names")
+        self.async_requester = async_requester
+        # Imported static data, consulted before ESI; picked up automatically
+        # if it has been imported to the default location
+        self.static = StaticUniverse.if_present() if static is UNSET else static
+        self._locations = None
+        self.cache = TieredCache(
+            memory_cache if memory_cache is not None else universe_memory_cache,
+            diskcache.Cache("eve_universe_names"),
+        )
 
-    def from_names(self, names):
-        found = {}
-        for name in names:
-            if ("name", name) in self.cache:
-                found[name] = self.cache.get(("name", name))
-        missing = list(set(name for name in names if name not in found))
-        if missing:
-            entries = _json(
-                self.requester.request(
-                    "POST",
-                    "/universe/ids",
-                    json=missing,
+    # Most names/ids ESI accepts in a single POST
+    names_chunk_size = 500
+    ids_chunk_size = 1000
+    # Chunks in flight at once
+    max_workers = 8
+    # Player structure ids start here; /universe/names never resolves them
+    structure_ids_from = 1000000000000
+
+    @staticmethod
+    def _entries(entries):
+        if isinstance(entries, (list, tuple)):
+            return entries
+        elif isinstance(entries, dict):
+            return itertools.chain.from_iterable(entries.values())
+        else:
+            raise ValueError(f"Unknown entity response type: {entries}")
+
+    def _remember(self, entries):
+        for entry in entries:
+            self.cache.set(("id", entry["id"]), entry["name"])
+            if entry["name"] is not None:
+                self.cache.set(("name", entry["name"]), entry["id"])
+
+    def _map_chunks(self, func, keys, size):
+        chunks = _chunks(keys, size)
+        if len(chunks) <= 1:
+            return [func(chunk) for chunk in chunks]
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(chunks)),
+        ) as executor:
+            return list(executor.map(func, chunks))
+
+    def _names_chunk(self, chunk):
+        entries = list(
+            self._entries(
+                _json(
+                    self.requester.request(
+                        "POST",
+                        "/universe/ids",
+                        json=chunk,
+                    )
                 )
             )
+        )
+        self._remember(entries)
+        return entries
 
-            if isinstance(entries, (list, tuple)):
-                seq = entries
-            elif isinstance(entries, dict):
-                seq = itertools.chain.from_iterable(entries.values())
-            else:
-                raise ValueError(f"Unknown entity response type: {entries}")
-
-            for entry in seq:
-                self.cache.set(("id", entry["id"]), entry["name"])
-                self.cache.set(("name", entry["name"]), entry["id"])
-                found[entry["name"]] = entry["id"]
+    def names_to_ids(self, names):
+        """Map each of `names` that ESI knows to its id."""
+        found = {}
+        for name in names:
+            cached = self.cache.get(("name", name), UNSET)
+            if cached is not UNSET:
+                found[name] = cached
+        missing = list(set(name for name in names if name not in found))
+        if missing and self.static is not None:
+            found.update(self.static.names_to_ids(missing))
+            missing = [name for name in missing if name not in found]
+        for entries in self._map_chunks(
+            self._names_chunk,
+            missing,
+            self.names_chunk_size,
+        ):
+            found.update((entry["name"], entry["id"]) for entry in entries)
+        return found
 
+    def from_names(self, names):
+        found = self.names_to_ids(names)
         return [Entity(entity_id=found[name], name=name) for name in names]
 
     def from_name(self, name):
         return self.from_names([name])[0]
 
-    def from_ids(self, ids):
+    def _ids_chunk(self, chunk):
+        res = self.requester.request(
+            "POST",
+            "/universe/names",
+            json=chunk,
+        )
+        if res.status_code in [400, 404]:
+            # ESI rejects the whole request if any id is unknown, so split
+            # the chunk to isolate the offending ids instead of losing every
+            # name in it.  Only for these: each split request counts against
+            # the error limit, so rate limiting and server errors the
+            # scheduler already gave up on are raised below instead.
+            if len(chunk) > 1:
+                half = len(chunk) // 2
+                return (
+                    self._ids_chunk(chunk[:half])
+                    + self._ids_chunk(chunk[half:])
+                )
+            entries = [{"id": id_, "name": None} for id_ in chunk]
+        else:
+            entries = list(self._entries(_json(res)))
+        self._remember(entries)
+        return entries
+
+    def ids_to_names(self, ids):
+        """
+        Map each of `ids` to its name.
+
+        Ids ESI can't name (player structures, for instance) map to None.
+        """
         found = {}
         for id_ in ids:
-            if ("id", id_) in self.cache:
-                found[id_] = self.cache.get(("id", id_))
+            cached = self.cache.get(("id", id_), UNSET)
+            if cached is not UNSET:
+                found[id_] = cached
         missing = list(set(id_ for id_ in ids if id_ not in found))
-        if missing:
-            res = self.requester.request(
-                "POST",
-                "/universe/names",
-                json=missing,
-            )
-            if not res.ok:
-                entries = [{"id": id_, "name": None} for id_ in missing]
-            else:
-                entries = _json(res)
-
-            if isinstance(entries, (list, tuple)):
-                seq = entries
-            elif isinstance(entries, dict):
-                seq = itertools.chain.from_iterable(entries.values())
-            else:
-                raise ValueError(f"Unknown entity response type: {entries}")
-
-            for entry in seq:
-                self.cache.set(("id", entry["id"]), entry["name"])
-                self.cache.set(("name", entry["name"]), entry["id"])
-                found[entry["id"]] = entry["name"]
+        structures = [id_ for id_ in missing if id_ >= self.structure_ids_from]
+        found.update(dict.fromkeys(structures))
+        missing = [id_ for id_ in missing if id_ < self.structure_ids_from]
+        if missing and self.static is not None:
+            found.update(self.static.ids_to_names(missing))
+            missing = [id_ for id_ in missing if id_ not in found]
+        for entries in self._map_chunks(
+            self._ids_chunk,
+            missing,
+            self.ids_chunk_size,
+        ):
+            found.update((entry["id"], entry["name"]) for entry in entries)
+        return found
 
+    def from_ids(self, ids):
+        found = self.ids_to_names(ids)
         return [Entity(entity_id=id_, name=found[id_]) for id_ in ids]
 
     def from_id(self, id_):
         return self.from_ids([id_])[0]
 
+    def _static_details(self, kind, id_):
+        if self.static is None:
+            return None
+        found = self.static.details(kind, id_)
+        if found is None:
+            # Type ids overlap the location id ranges, so only a location of
+            # another kind rules this one out
+            others = [
+                k for k in self.static.kinds_of(id_)
+                if k != "type" and kind != "type"
+            ]
+            if others:
+                # ESI would only answer 404, at the cost of error budget
+                raise KeyError(f"{id_} is a {others[0]}, not a {kind}")
+        return found
+
     def details(self, kind, entity=None, name=None, entity_id=None):
         if entity_id:
             id_ = entity_id
@@ -285,23 +862,74 @@ class UniverseLookup:
         elif name:
             id_ = self.from_name(name).id
 
-        if ("detail", kind, id_) not in self.cache:
-            kind = kind.lower().rstrip("s")
+        kind = kind.lower().rstrip("s")
+        result = self._static_details(kind, id_)
+        if result is not None:
+            return result
+        result = self.cache.get(("detail", kind, id_))
+        if result is None:
             result = _json(
                 self.requester.request("GET", f"/universe/{kind}s/{id_}")
             )
             self.cache.set(("detail", kind, id_), result)
 
-        return self.cache.get(("detail", kind, id_))
+        return result
+
+    async def adetails(self, kind, entity=None, name=None, entity_id=None):
+        if self.async_requester is None:
+            raise ValueError(
+                "No async requester present.  "
+                "Re-instantiate with a valid async requester"
+            )
+
+        if entity_id:
+            id_ = entity_id
+        elif entity:
+            id_ = entity.id
+        elif name:
+            id_ = self.from_name(name).id
+
+        kind = kind.lower().rstrip("s")
+        result = self._static_details(kind, id_)
+        if result is not None:
+            return result
+        result = self.cache.get(("detail", kind, id_))
+        if result is None:
+            result = _json(
+                await self.async_requester.request(
+                    "GET",
+                    f"/universe/{kind}s/{id_}",
+                )
+            )
+            self.cache.set(("detail", kind, id_), result)
+
+        return result
+
+    async def adetails_seq(self, kind, entity_ids):
+        return await asyncio.gather(
+            *(self.adetails(kind, entity_id=id_) for id_ in entity_ids)
+        )
+
+    @property
+    def locations(self):
+        if self._locations is None:
+            self._locations = LocationIndex(self)
+        return self._locations
 
     def chain_seq(self, entity, k_chain, default=UNSET):
-        ka_chain = [(a, f"{b}_id") for (a, b) in zip(k_chain, k_chain[1:])]
+        pairs = list(zip(k_chain, k_chain[1:]))
 
         found = entity.id
 
-        for (kind, attr) in ka_chain:
+        for (kind, parent_kind) in pairs:
+            parent = self.locations.parent(kind, found, parent_kind)
+            if parent is not None:
+                found = parent
+                continue
             try:
-                found = self.details(kind, entity_id=found)[attr]
+                parent = self.details(kind, entity_id=found)[f"{parent_kind}_id"]
+                self.locations.learn(kind, found, parent)
+                found = parent
             except KeyError:
                 if default is UNSET:
                     raise
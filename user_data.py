@@ -45,7 +45,9 @@ def rolling_weighted_dict_average(acc, seq):
 
 class UserAssets:
 
-    def __init__(self, requester, character_name):
+    def __init__(self, requester, character_name, response_cache=None):
+        if response_cache is not None:
+            requester = requester.cached(response_cache)
         self.requester = requester
         self.character_name = character_name
         self._character_id = None
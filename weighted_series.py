@@ -1,4 +1,5 @@
 from cytoolz import curry
+import numpy as np
 
 
 class WeightedSeries:
@@ -14,8 +15,12 @@ class WeightedSeries:
         return cls(values, weights)
 
     def __init__(self, values, weights=None):
-        self._values = values
-        self._weights = weights
+        self._values = np.asarray(values, dtype=np.float64)
+        self._weights = (
+            np.asarray(weights, dtype=np.float64) if weights is not None
+            else None
+        )
+        self._order = None
 
     @property
     def values(self):
@@ -24,56 +29,234 @@ class WeightedSeries:
     @property
     def weights(self):
         if self._weights is None:
-            return [1]*len(self.values)
+            return np.ones(len(self._values))
         else:
             return self._weights
 
+    @property
+    def order(self):
+        """Indices sorting the values; computed once and cached."""
+        if self._order is None:
+            self._order = np.argsort(self._values, kind="stable")
+        return self._order
+
+    @property
+    def sorted_values(self):
+        return self._values[self.order]
+
+    def __len__(self):
+        return len(self._values)
+
     def __repr__(self):
         return f"<WeightedSeries (size: {len(self.values)})>"
 
 
+def _percentile_index(pct, size):
+    k_d = (pct/100) * size
+    k = int(k_d)
+    return (k, k_d - k)
+
+
 class WeightedSeriesMetrics:
 
     @classmethod
     def average(cls, series):
-        return sum(series.values) / len(series.values)
+        if len(series) == 0:
+            raise ZeroDivisionError("average of an empty series")
+        return series.values.mean().item()
 
     @classmethod
     def weighted_average(cls, series):
-        total_cost = sum(
-            x*y for (x, y) in zip(series.values, series.weights)
-        )
-        total_purchased = sum(series.weights)
-        return total_cost / total_purchased
+        total_purchased = series.weights.sum()
+        if total_purchased == 0:
+            raise ZeroDivisionError("weighted average with no weight")
+        total_cost = np.dot(series.values, series.weights)
+        return (total_cost / total_purchased).item()
 
     @classmethod
     def maximum(cls, series):
-        return max(series.values)
+        return series.values.max().item()
 
     @classmethod
     def minimum(cls, series):
-        return min(series.values)
+        return series.values.min().item()
 
     @classmethod
     @curry
     def percentile(cls, pct, series):
         if not series:
             return None
-        seq = series.values
-        ordered = sorted(seq)
-        if not ordered:
-            return None
-        N = len(ordered)
-        k_d = (pct/100) * N
-        k = int(k_d)
-        d = k_d - k
+        N = len(series)
+        (k, d) = _percentile_index(pct, N)
         if k == 0:
-            return ordered[0]
+            return series.values.min().item()
         elif k >= N-1:
-            return ordered[-1]
+            return series.values.max().item()
+
+        if series._order is not None:
+            ordered = series.sorted_values
         else:
-            return ordered[k] + d*(ordered[k+1] - ordered[k])
+            # Only the two neighbouring order statistics are needed, so avoid
+            # a full sort unless one is already cached
+            ordered = np.partition(series.values, [k, k+1])
+        return (ordered[k] + d*(ordered[k+1] - ordered[k])).item()
+
+    @classmethod
+    @curry
+    def weighted_percentile(cls, pct, series):
+        """
+        Volume-weighted percentile: the value below which `pct` percent of the
+        total weight lies.
+        """
+        if not series:
+            return None
+        cumulative = np.cumsum(series.weights[series.order])
+        target = (pct/100) * cumulative[-1]
+        i = np.searchsorted(cumulative, target, side="left")
+        return series.sorted_values[min(i, len(series) - 1)].item()
 
     @classmethod
     def total_weight(cls, series):
-        return sum(series.weights)
+        return series.weights.sum().item()
+
+    @classmethod
+    def batch(cls, series_seq, metrics):
+        """
+        Evaluate many metrics over many series at once.
+
+        `metrics` maps a name to an aggregate spec, which is the name of a
+        `SeriesBatch` method followed by its arguments, e.g.
+        `{"p20": ("percentile", 20), "max": ("maximum",)}`.
+
+        Returns one dict per series, mapping each metric name to its value (or
+        None where the series is empty).
+        """
+        results = SeriesBatch(series_seq).evaluate(metrics)
+        return [
+            {
+                name: (None if np.isnan(values[i]) else values[i].item())
+                for (name, values) in results.items()
+            }
+            for i in range(len(series_seq))
+        ]
+
+
+class SeriesBatch:
+    """
+    Many weighted series, concatenated and sorted together.
+
+    All the series are sorted in a single `lexsort` by (series, value), after
+    which every metric is a handful of vectorized operations over the whole
+    batch.  Each metric returns one value per series, NaN for empty series.
+    """
+
+    def __init__(self, series_seq):
+        series_seq = list(series_seq)
+        counts = np.array([len(s) for s in series_seq], dtype=np.int64)
+        segments = np.repeat(np.arange(len(series_seq)), counts)
+        if counts.sum():
+            values = np.concatenate([s.values for s in series_seq])
+            weights = np.concatenate([s.weights for s in series_seq])
+        else:
+            values = np.array([], dtype=np.float64)
+            weights = np.array([], dtype=np.float64)
+        self._build(values, weights, segments, len(series_seq))
+
+    @classmethod
+    def from_arrays(cls, values, weights, segments, size):
+        """
+        Build a batch straight from flat arrays, without `WeightedSeries`.
+
+        `segments[i]` is the index (below `size`) of the series that
+        `values[i]` and `weights[i]` belong to.
+        """
+        batch = cls.__new__(cls)
+        batch._build(
+            np.asarray(values, dtype=np.float64),
+            np.asarray(weights, dtype=np.float64),
+            np.asarray(segments, dtype=np.int64),
+            size,
+        )
+        return batch
+
+    def _build(self, values, weights, segments, size):
+        self.size = size
+        self.counts = np.bincount(segments, minlength=size).astype(np.int64)
+        self.starts = np.cumsum(self.counts) - self.counts
+        order = np.lexsort((values, segments))
+        self.values = values[order]
+        self.weights = weights[order]
+        self.segments = segments[order]
+        self._nonempty = self.counts > 0
+
+    def _at(self, offsets):
+        """Pick `values[starts + offsets]` for non-empty series, NaN others."""
+        result = np.full(self.size, np.nan)
+        nonempty = self._nonempty
+        result[nonempty] = self.values[self.starts[nonempty] + offsets[nonempty]]
+        return result
+
+    def minimum(self):
+        return self._at(np.zeros(self.size, dtype=np.int64))
+
+    def maximum(self):
+        return self._at(self.counts - 1)
+
+    def percentile(self, pct):
+        # Same interpolation as `WeightedSeriesMetrics.percentile`
+        k_d = (pct/100) * self.counts
+        k = k_d.astype(np.int64)
+        d = k_d - k
+        interior = (k > 0) & (k < self.counts - 1)
+        k_clipped = np.clip(k, 0, np.maximum(self.counts - 1, 0))
+        lower = self._at(k_clipped)
+        upper = self._at(np.minimum(k_clipped + 1, np.maximum(self.counts - 1, 0)))
+        result = np.where(
+            k >= self.counts - 1,
+            self.maximum(),
+            np.where(k == 0, self.minimum(), lower),
+        )
+        result[interior] = (
+            lower[interior] + d[interior]*(upper[interior] - lower[interior])
+        )
+        return result
+
+    def weighted_percentile(self, pct):
+        cumulative = np.cumsum(self.weights)
+        before = np.concatenate([[0.0], cumulative])[self.starts]
+        total = self.total_weight()
+        target = before + (pct/100) * total
+        i = np.searchsorted(cumulative, target, side="left") - self.starts
+        return self._at(np.clip(i, 0, np.maximum(self.counts - 1, 0)))
+
+    def total_weight(self):
+        return np.bincount(
+            self.segments,
+            weights=self.weights,
+            minlength=self.size,
+        )
+
+    def average(self):
+        totals = np.bincount(
+            self.segments,
+            weights=self.values,
+            minlength=self.size,
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self._nonempty, totals / self.counts, np.nan)
+
+    def weighted_average(self):
+        totals = np.bincount(
+            self.segments,
+            weights=self.values * self.weights,
+            minlength=self.size,
+        )
+        weights = self.total_weight()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(weights > 0, totals / weights, np.nan)
+
+    def evaluate(self, metrics):
+        return {
+            name: getattr(self, aggregate)(*args)
+            for (name, (aggregate, *args)) in metrics.items()
+        }